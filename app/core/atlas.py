@@ -0,0 +1,91 @@
+# External
+import logging, time
+import numpy as np
+from PIL import Image, ImageFont, ImageDraw
+from pathlib import Path
+# Internal
+from app.core.labelmap import LabelMap
+
+
+class Atlas:
+    '''Province name sprites, rendered once per name and placed once per map, so drawing labels is a single pixel write'''
+    def __init__(self, font: Path, size: int = 12) -> None:
+        '''Province name sprites, rendered once per name and placed once per map, so drawing labels is a single pixel write
+        :font: path to font for labels
+        :size: Font size in pixels'''
+        self.font_path: Path = font
+        self.size: int = size
+        self.font: ImageFont.FreeTypeFont = ImageFont.truetype(font=font.__str__(), size=size)
+        self.sprites: dict[str, np.ndarray] = {} # Text -> bool mask of its glyph pixels
+        self.placed: dict[str, tuple[np.ndarray, np.ndarray]] = {} # Province -> (ys, xs) of its label in map coordinates
+        self.index: dict[str, int] = {} # Province -> label index, from the label raster placed on
+        self.ys: np.ndarray = np.zeros(0, dtype=np.int64) # Every placed label pixel, for drawing all at once
+        self.xs: np.ndarray = np.zeros(0, dtype=np.int64)
+        self.ids: np.ndarray = np.zeros(0, dtype=np.int64) # Label index of the province each pixel belongs to
+
+    def copy(self) -> "Atlas":
+        '''Get a copy to place on another label raster, e.g. one shared between games. Sprites already rendered are kept. Returns Atlas object.'''
+        atlas = Atlas(font=self.font_path, size=self.size)
+        atlas.sprites = dict(self.sprites)
+        return atlas
+
+    def get_sprite(self, text: str) -> np.ndarray:
+        '''Get the glyph pixels of a text, rendering it the first time. Returns (h, w) bool array.
+        :text: Text to render'''
+        if (text not in self.sprites):
+            x0, y0, x1, y1 = self.font.getbbox(text)
+            img = Image.new("L", (max(x1 - x0, 1), max(y1 - y0, 1)), 0)
+            ImageDraw.Draw(img).text((-x0, -y0), text, fill=255, font=self.font)
+            self.sprites.update({text: np.array(object=img) >= 128})
+        return self.sprites[text]
+
+    def place(self, labels: LabelMap, anchors: dict[str, tuple]) -> None:
+        '''Place province names on the map, centred on their anchors and clipped to their province, so the next fill clears them.
+        :labels: Province label raster
+        :anchors: Province name -> (x, y) centre of its label'''
+        tic = time.perf_counter()
+        self.placed = {}
+        self.index = labels.index
+        height, width = labels.shape
+        for prov, (x, y) in anchors.items():
+            if (prov not in labels.index):
+                continue
+            sy, sx = np.nonzero(self.get_sprite(text=prov))
+            h, w = self.sprites[prov].shape
+            ys = sy + int(y) - h // 2
+            xs = sx + int(x) - w // 2
+            inside = (ys >= 0) & (ys < height) & (xs >= 0) & (xs < width)
+            ys, xs = ys[inside], xs[inside]
+            keep = labels.raster[ys, xs] == labels.index[prov]
+            self.placed.update({prov: (ys[keep], xs[keep])})
+
+        self.ys = self.xs = self.ids = np.zeros(0, dtype=np.int64)
+        if (len(self.placed) > 0):
+            self.ys = np.concatenate([ys for ys, _ in self.placed.values()])
+            self.xs = np.concatenate([xs for _, xs in self.placed.values()])
+            self.ids = np.concatenate([np.full(len(ys), labels.index[prov], dtype=np.int64) for prov, (ys, _) in self.placed.items()])
+        toc = time.perf_counter()
+        logging.info(f"Placed {len(self.placed)} labels, {len(self.ys)} pixels {toc - tic:0.4f}s")
+
+    def get_pixels(self, provinces: list[str] = None) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        '''Get placed label pixels. Returns (ys, xs, label index of each pixel).
+        :provinces: Only these provinces, None for all'''
+        if (provinces == None):
+            return self.ys, self.xs, self.ids
+        parts = [prov for prov in provinces if prov in self.placed]
+        if (len(parts) == 0):
+            empty = np.zeros(0, dtype=np.int64)
+            return empty, empty, empty
+        return (np.concatenate([self.placed[prov][0] for prov in parts]),
+                np.concatenate([self.placed[prov][1] for prov in parts]),
+                np.concatenate([np.full(len(self.placed[prov][0]), self.index[prov], dtype=np.int64) for prov in parts]))
+
+    @staticmethod
+    def get_contrast(colors: np.ndarray) -> np.ndarray:
+        '''Get black or white text for each fill color, whichever stands out more. Returns array shaped like colors.
+        :colors: (n, 3) uint8 fill colors'''
+        luma = colors.astype(np.float32) @ np.array([0.299, 0.587, 0.114], dtype=np.float32)
+        return np.repeat(np.where(luma > 140, 0, 255).astype(np.uint8)[:, None], 3, axis=1)
+
+    def __repr__(self) -> str: return self.__str__() # Printable representation
+    def __str__(self) -> str: return f"Atlas({len(self.sprites)} sprites, {len(self.placed)} placed)" # String representation
@@ -12,8 +12,10 @@ class Claim:
     self_owned: Status = Status(name="self_owned", value=4)
     other_owned: Status = Status(name="other_owned", value=8)
     not_adjacent: Status = Status(name="not_adjacent", value=16)
+    no_funds: Status = Status(name="no_funds", value=32)
 
-    list: dict[str, Status] = {"not_adjacent": not_adjacent, # 16
+    list: dict[str, Status] = {"no_funds": no_funds,         # 32
+                               "not_adjacent": not_adjacent, # 16
                                "other_owned": other_owned,   # 8
                                "self_owned": self_owned,     # 4
                                "water": water,               # 2
@@ -1,5 +1,5 @@
 # External
-import json, logging
+import json, logging, sqlite3, time
 import numpy as np
 from pathlib import Path
 
@@ -15,7 +15,21 @@ class Data:
                 self.ext: str = ext
         json: Type = Type(name="json", full="json data", ext=".json")
         npz: Type = Type(name="npz", full="NumPy data archive", ext=".npz")
-        types: dict[str, Type] = {"json": json}
+        sqlite: Type = Type(name="sqlite", full="SQLite player state and history", ext=".db")
+        types: dict[str, Type] = {"json": json, "sqlite": sqlite}
+
+    # Schema for Source.sqlite. Holds player data in the same shape as players.json, plus claim history.
+    SCHEMA: list[str] = [
+        "CREATE TABLE IF NOT EXISTS players (key TEXT PRIMARY KEY, position INTEGER, name TEXT, snowflake INTEGER, "
+        "color TEXT, custom_color TEXT, balance INTEGER NOT NULL DEFAULT 0)",
+        "CREATE TABLE IF NOT EXISTS owned (kind TEXT NOT NULL, name TEXT NOT NULL, player TEXT NOT NULL, "
+        "PRIMARY KEY (kind, name))",
+        "CREATE INDEX IF NOT EXISTS owned_player ON owned (player)",
+        "CREATE TABLE IF NOT EXISTS claims (id INTEGER PRIMARY KEY, turn INTEGER NOT NULL, player TEXT NOT NULL, "
+        "province TEXT NOT NULL, cost INTEGER NOT NULL, time REAL NOT NULL)",
+        "CREATE INDEX IF NOT EXISTS claims_player ON claims (player, turn)",
+        "CREATE INDEX IF NOT EXISTS claims_province ON claims (province, turn)",
+        "CREATE INDEX IF NOT EXISTS claims_turn ON claims (turn)"]
 
     def __init__(self, file: Path, source: Source.Type = Source.json) -> None:
         '''Class for accessing and manipulating data
@@ -23,6 +37,8 @@ class Data:
         :source: Data source object. Data.Source.Type object, enumated in Data.Source.sources'''
         self.path: Path = file
         self.source: Data.Source.Type = source
+        self.connection: sqlite3.Connection = None
+        self.written: dict = {} # Last state written to sqlite, to only write what changed
         self.data: dict = self.__load_data(path=self.path.__str__())
 
     def __load_data(self, path: str) -> dict:
@@ -32,6 +48,8 @@ class Data:
                 return self.__load_json(path=path)
             case Data.Source.npz:
                 return self.__load_npz(path=path)
+            case Data.Source.sqlite:
+                return self.__load_sqlite(path=path)
             case _: return {} # This should never happen. Update loop with new data sources.
 
     def __load_json(self, path: str) -> dict:
@@ -55,30 +73,180 @@ class Data:
             logging.warning(f"Assuming file is empty or missing, returning empty dataset.")
             return {}
 
-    def __write_json(self) -> None:
-        '''Writes json to self.path from self.data'''
+    def __connect(self, path: str) -> sqlite3.Connection:
+        '''Open the sqlite database, creating the schema if needed'''
+        if (self.connection == None):
+            # Used from the reloader and scheduler threads too, callers keep access serialized
+            self.connection = sqlite3.connect(database=path, check_same_thread=False)
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute("PRAGMA synchronous=NORMAL")
+            with self.connection:
+                for statement in Data.SCHEMA:
+                    self.connection.execute(statement)
+        return self.connection
+
+    def __load_sqlite(self, path: str) -> dict:
+        '''Buffers player data from sqlite at self.path into self.data'''
+        try:
+            logging.info(f"Loading data from file: {self.path.__str__()}")
+            db = self.__connect(path=path)
+            data: dict = {}
+            for key, name, snowflake, color, custom_color, balance in db.execute(
+                    "SELECT key, name, snowflake, color, custom_color, balance FROM players ORDER BY position"):
+                data.update({key: {"name": name,
+                                   "snowflake": snowflake,
+                                   "color": color,
+                                   "custom_color": json.loads(custom_color) if custom_color != None else None,
+                                   "owned": {"regions": [], "provinces": []},
+                                   "balance": balance}})
+            for kind, name, player in db.execute("SELECT kind, name, player FROM owned ORDER BY rowid"):
+                if (player in data):
+                    data[player]["owned"]["regions" if kind == "region" else "provinces"].append(name)
+            self.written = json.loads(json.dumps(data))
+            return data
+        except Exception as e:
+            logging.error(f"*** File load error: {str(e)}")
+            logging.warning(f"Assuming file is empty or missing, returning empty dataset.")
+            return {}
+
+    def __write_sqlite(self, history: list[tuple] = None, turn: int = 0) -> bool:
+        '''Writes player data to sqlite from self.data, only the players that changed, and claims to the history, in one transaction.
+        Returns True on success.'''
+        try:
+            logging.info(f"Writing data to file: {self.path.__str__()}")
+            db = self.__connect(path=self.path.__str__())
+            changed: list[str] = [key for key in self.data if self.data[key] != self.written.get(key)]
+            removed: list[str] = [key for key in self.written if key not in self.data]
+            positions: dict[str, int] = {key: i for i, key in enumerate(self.data)}
+
+            with db:
+                db.executemany("DELETE FROM owned WHERE player = ?", [(key,) for key in changed + removed])
+                db.executemany("DELETE FROM players WHERE key = ?", [(key,) for key in removed])
+                db.executemany("INSERT OR REPLACE INTO players (key, position, name, snowflake, color, custom_color, balance) "
+                               "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                               [(key, positions[key], self.data[key]["name"], self.data[key]["snowflake"], self.data[key]["color"],
+                                 json.dumps(self.data[key]["custom_color"]) if self.data[key]["custom_color"] != None else None,
+                                 self.data[key].get("balance", 0)) for key in changed])
+                db.executemany("INSERT OR REPLACE INTO owned (kind, name, player) VALUES (?, ?, ?)",
+                               [(kind, name, key) for key in changed
+                                for kind, names in (("region", self.data[key]["owned"]["regions"]),
+                                                    ("province", self.data[key]["owned"]["provinces"]))
+                                for name in names])
+                Data.__insert_history(db=db, claims=history or [], turn=turn)
+            self.written = json.loads(json.dumps(self.data))
+            return True
+        except Exception as e:
+            logging.error(f"*** File write error: {str(e)}")
+            return False
+
+    @staticmethod
+    def __insert_history(db: sqlite3.Connection, claims: list[tuple], turn: int) -> None:
+        '''Insert claims into the history table, inside the caller's transaction'''
+        now: float = time.time()
+        db.executemany("INSERT INTO claims (turn, player, province, cost, time) VALUES (?, ?, ?, ?, ?)",
+                       [(turn, player, province, cost, now) for player, province, cost in claims])
+
+    def add_history(self, claims: list[tuple], turn: int = 0) -> None:
+        '''Record claims in the history table, in one transaction. Only kept by Source.sqlite.
+        To record claims together with the ownership they changed, pass them to write_data instead.
+        :claims: List of (player key, province name, cost)
+        :turn: Turn number the claims belong to'''
+        if (self.source != Data.Source.sqlite or len(claims) == 0):
+            return
+        with self.__connect(path=self.path.__str__()) as db:
+            Data.__insert_history(db=db, claims=claims, turn=turn)
+
+    def get_history(self, player: str = None, province: str = None, turn: int = None, limit: int = None) -> list[dict]:
+        '''Query claim history, newest first. Only kept by Source.sqlite. Returns list of dicts.
+        :player: Only claims by this player key
+        :province: Only claims of this province
+        :turn: Only claims in this turn
+        :limit: Most rows to return'''
+        if (self.source != Data.Source.sqlite):
+            return []
+        where: list[str] = []
+        args: list = []
+        for column, value in (("player", player), ("province", province), ("turn", turn)):
+            if (value != None):
+                where.append(f"{column} = ?")
+                args.append(value)
+        query: str = "SELECT turn, player, province, cost, time FROM claims"
+        if (len(where) > 0):
+            query += " WHERE " + " AND ".join(where)
+        query += " ORDER BY id DESC"
+        if (limit != None):
+            query += " LIMIT ?"
+            args.append(limit)
+        rows = self.__connect(path=self.path.__str__()).execute(query, args).fetchall()
+        return [{"turn": t, "player": pl, "province": pr, "cost": c, "time": ti} for t, pl, pr, c, ti in rows]
+
+    def get_turn(self) -> int:
+        '''Get the latest turn in the claim history. Only kept by Source.sqlite. Returns 0 if there is none.'''
+        if (self.source != Data.Source.sqlite):
+            return 0
+        row = self.__connect(path=self.path.__str__()).execute("SELECT MAX(turn) FROM claims").fetchone()
+        return row[0] if row[0] != None else 0
+
+    def get_owner(self, province: str) -> str:
+        '''Get the player key owning a province outright (not through a region). Only for Source.sqlite. Returns None if unowned.
+        :province: Province name'''
+        if (self.source != Data.Source.sqlite):
+            return None
+        row = self.__connect(path=self.path.__str__()).execute(
+            "SELECT player FROM owned WHERE kind = 'province' AND name = ?", (province,)).fetchone()
+        return row[0] if row != None else None
+
+    @staticmethod
+    def import_json(json_file: Path, db_file: Path) -> "Data":
+        '''Import a players.json file into a sqlite database. Returns the sqlite Data object.
+        :json_file: Player data in json
+        :db_file: sqlite database to write, created if missing'''
+        source = Data(file=json_file, source=Data.Source.json)
+        target = Data(file=db_file, source=Data.Source.sqlite)
+        target.data = source.data
+        target.write_data()
+        return target
+
+    def close(self) -> None:
+        '''Close the sqlite connection, if any'''
+        if (self.connection != None):
+            self.connection.close()
+            self.connection = None
+
+    def __write_json(self) -> bool:
+        '''Writes json to self.path from self.data, through a temporary file so a failed write leaves the old file. Returns True on success.'''
         try:
             logging.info(f"Writing data to file: {self.path.__str__()}")
-            with open(file=self.path.__str__(), mode='w', encoding='utf-8') as f:
+            temp: Path = self.path.with_name(self.path.name + ".tmp")
+            with open(file=temp.__str__(), mode='w', encoding='utf-8') as f:
                 json.dump(self.data, f, ensure_ascii=False, indent=2)
+            temp.replace(self.path)
+            return True
         except Exception as e:
             logging.error(f"*** File write error: {str(e)}")
+            return False
 
-    def __write_npz(self) -> None:
-        '''Writes NumPy data to self.path from self.data'''
+    def __write_npz(self) -> bool:
+        '''Writes NumPy data to self.path from self.data. Returns True on success.'''
         try:
             logging.info(f"Writing data to file: {self.path.__str__()}")
             np.savez_compressed(file=self.path, **self.data)
+            return True
         except Exception as e:
             logging.error(f"*** File write error: {str(e)}")
+            return False
 
     def load_data(self, path: str) -> dict:
         '''Load from data source to buffer'''
-        self.__load_data(path=path)
+        self.data = self.__load_data(path=path)
+        return self.data
 
-    def write_data(self) -> None:
-        '''Write buffer to data source'''
+    def write_data(self, history: list[tuple] = None, turn: int = 0) -> bool:
+        '''Write buffer to data source. Returns True on success, errors are logged.
+        :history: Claims to record as (player key, province name, cost), in the same transaction. Only kept by Source.sqlite.
+        :turn: Turn number the claims belong to'''
         match self.source:
-            case Data.Source.json: self.__write_json()
-            case Data.Source.npz: self.__write_npz()
-            case _: return # This should never happen. Update loop with new data sources.
\ No newline at end of file
+            case Data.Source.json: return self.__write_json()
+            case Data.Source.npz: return self.__write_npz()
+            case Data.Source.sqlite: return self.__write_sqlite(history=history, turn=turn)
+            case _: return False # This should never happen. Update loop with new data sources.
\ No newline at end of file
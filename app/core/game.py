@@ -9,12 +9,21 @@ from app.core.player import Player
 from app.core.data import Data
 from app.core.map import Map
 from app.core.claim import Claim
+from app.core.reach import Reach
+from app.core.labelmap import LabelMap
+from app.core.atlas import Atlas
+from app.core.transaction import Transaction
+from app.core.stats import Stats
 
 
 class Game:
     '''Game class for o9-province'''
-    def __init__(self, leveld: Data, maskd: Data, mapd: Data, playerd: Data, map: Map) -> None:
-        '''Game class for o9-province'''
+    def __init__(self, leveld: Data, maskd: Data, mapd: Data, playerd: Data, map: Map,
+                 labels: LabelMap = None, reach: Reach = None, atlas: Atlas = None) -> None:
+        '''Game class for o9-province
+        :labels: Already loaded label raster to share between games, maskd is not read if set
+        :reach: Already computed hop distances to share between games
+        :atlas: Draw province names from this atlas, placed on load if it is not yet. None for no names.'''
 
         # Setup timer
         logging.info("Loading data...")
@@ -34,7 +43,12 @@ class Game:
         self.players: dict[str, Player] = {}
         self.ocean_provs: list[str] = []
         self.sea_provs: dict[str, list[str]] = {}
-        self.masks: dict[str, np.ndarray] = {}
+        self.labels: LabelMap = labels
+        self.reach: Reach = reach
+        self.atlas: Atlas = atlas
+        self.shared: set[str] = {name for name, obj in (("labels", labels), ("reach", reach), ("atlas", atlas)) if obj != None} # Copied before changing
+        self.stats: Stats = None
+        self.turn: int = 0 # Recorded with claim history, one per committed transaction
 
         # Load in data
         self.__load_data()
@@ -57,85 +71,206 @@ class Game:
     def __load_mapdata(self) -> None:
         '''Load data about maps'''
         for reg in self.map_data.data:
-            self.regions.update({reg: Region(name=reg)})
             for prov in self.map_data.data[reg]:
-                province = self.map_data.data[reg][prov]
-                level = self.levels[province["level"]]
-                x, y = province["pos"]
-                self.provinces.update({prov: Province(name=prov,level=level,pos=(x,y))})
-                self.regions[reg].add_province(self.provinces[prov])
-                
-                for adj in province["adjacent"]:
-                    self.provinces[prov].add_adjacent(adj)
-                
-                if (province["ocean"]):
-                    self.ocean_provs.append(prov)
-                    self.provinces[prov].ocean = True
-
-                if (province["sea"]):
-                    for sea in province["seas"]:
-                        if (sea in self.sea_provs):
-                            self.sea_provs[sea].append(prov)
-                        else:
-                            self.sea_provs.update({sea: []})
-                            self.sea_provs[sea].append(prov)
-                        self.provinces[prov].sea = True
-                        self.provinces[prov].seas.append(sea)
+                self.add_province(region=reg, name=prov, data=self.map_data.data[reg][prov])
+
+    def add_province(self, region: str, name: str, data: dict) -> Province:
+        '''Add a province from its map data entry, creating the region if needed. Returns Province object.
+        :region: Region name
+        :name: Province name
+        :data: Map data entry with pos, level, sea, seas, ocean and adjacent'''
+        if (region not in self.regions):
+            self.regions.update({region: Region(name=region)})
+        level = self.levels[data["level"]]
+        x, y = data["pos"]
+        self.provinces.update({name: Province(name=name,level=level,pos=(x,y))})
+        self.regions[region].add_province(self.provinces[name])
+        self.update_province(name=name, data=data)
+        return self.provinces[name]
+
+    def update_province(self, name: str, data: dict) -> None:
+        '''Update adjacency, ocean/sea access and level of a province from its map data entry
+        :name: Province name
+        :data: Map data entry with level, sea, seas, ocean and adjacent'''
+        province = self.provinces[name]
+        if (province.level.name != data["level"]):
+            province.update_level(level=self.levels[data["level"]])
+
+        province.adjacent = []
+        for adj in data["adjacent"]:
+            province.add_adjacent(adj)
+
+        if (province.ocean):
+            self.ocean_provs.remove(name)
+        province.ocean = False
+        if (data["ocean"]):
+            self.ocean_provs.append(name)
+            province.ocean = True
+
+        for sea in province.seas:
+            self.sea_provs[sea].remove(name)
+        province.sea = False
+        province.seas = []
+        if (data["sea"]):
+            for sea in data["seas"]:
+                if (sea in self.sea_provs):
+                    self.sea_provs[sea].append(name)
+                else:
+                    self.sea_provs.update({sea: []})
+                    self.sea_provs[sea].append(name)
+                province.sea = True
+                province.seas.append(sea)
+
+    def add_label(self, name: str) -> bool:
+        '''Add a province to the label raster from its seed point, without touching the other provinces. Returns True if labelled.
+        A shared label raster is copied first, so other games keep theirs.
+        :name: Province name'''
+        x, y = self.provinces[name].pos_xy
+        if (not self.map.is_land(x=x, y=y, levels=self.levels)):
+            logging.warning(f"Seed of {name} at {(x, y)} is not on a province color, not labelling it")
+            return False
+        mask = self.map.get_mask((x, y)) & (self.labels.raster == 0)
+        if (not mask.any()):
+            logging.warning(f"Seed of {name} at {(x, y)} is inside another province, not labelling it")
+            return False
+        if ("labels" in self.shared):
+            self.labels = self.labels.copy()
+            self.shared.discard("labels")
+        self.labels.add(name=name, mask=mask)
+        return True
 
     def __load_players(self) -> None:
-        '''Load player data and set ownership'''
+        '''Load player data and set ownership, and carry on from the last turn in the claim history'''
         for play in self.player_data.data:
-            player = self.player_data.data[play]
-            if (player["custom_color"] != None):
-                r, g, b = player["custom_color"]
-                color = ColorBase(name=play, rgb=(r, g, b))
-                self.players.update({play: Player(name=player["name"], 
-                                                  snowflake=player["snowflake"], 
-                                                  color=color,
-                                                  levels=self.levels)})
-            else:
-                self.players.update({play: Player(name=player["name"], 
-                                                  snowflake=player["snowflake"], 
-                                                  color=Color.list[player["color"]],
-                                                  levels=self.levels)})
-                
-            for reg in player["owned"]["regions"]: # Iterate through regions owned
-                for prov in self.regions[reg].provinces: # Iterate through provinces in the region
-                    self.provinces[prov].update_owner(owner=self.players[play])
-            for prov in player["owned"]["provinces"]: # Iterate through provinces owned
+            self.add_player(key=play, data=self.player_data.data[play])
+            for prov in self.get_holdings(data=self.player_data.data[play]):
                 self.provinces[prov].update_owner(owner=self.players[play])
+        self.turn = self.player_data.get_turn()
+
+    def next_turn(self) -> int:
+        '''Advance to the next turn, claims saved from now on are recorded in it. Returns new turn.'''
+        self.turn += 1
+        return self.turn
+
+    @staticmethod
+    def get_player_color(key: str, data: dict) -> ColorBase:
+        '''Get the base color of a player from its player data entry. Returns ColorBase object.
+        :key: Player key in player data
+        :data: Player data entry'''
+        if (data["custom_color"] != None):
+            r, g, b = data["custom_color"]
+            return ColorBase(name=key, rgb=(r, g, b))
+        else:
+            return Color.list[data["color"]]
+
+    def add_player(self, key: str, data: dict) -> Player:
+        '''Add a player from its player data entry, without ownership. Returns Player object.
+        :key: Player key in player data
+        :data: Player data entry'''
+        self.players.update({key: Player(name=data["name"], 
+                                         snowflake=data["snowflake"], 
+                                         color=Game.get_player_color(key=key, data=data),
+                                         levels=self.levels)})
+        self.players[key].balance = data.get("balance", 0)
+        return self.players[key]
+
+    def get_holdings(self, data: dict) -> list[str]:
+        '''Get provinces a player data entry owns, regions expanded. Returns list of province names.
+        :data: Player data entry'''
+        holdings: list[str] = []
+        for reg in data["owned"]["regions"]: # Iterate through regions owned
+            holdings += list(self.regions[reg].provinces) # Iterate through provinces in the region
+        holdings += data["owned"]["provinces"] # Iterate through provinces owned
+        return holdings
+
+    def __load_stats(self) -> None:
+        '''Count current holdings, then follow every owner/level change'''
+        self.reset_stats()
+
+    def reset_stats(self) -> None:
+        '''Rebuild aggregates from scratch, e.g. after provinces or regions change'''
+        if (self.stats != None):
+            for prov in self.provinces.values():
+                self.stats.unwatch(province=prov)
+        self.stats = Stats(regions=self.regions)
+        for prov in self.provinces.values():
+            self.stats.watch(province=prov)
 
     def __load_masks(self) -> None:
         tic = time.perf_counter()
         logging.info("Loading mask data...")
-
-        if self.mask_data.data == {}:
-            # Missing, generate mask data
-            masks: dict = {}
-            for prov in self.provinces:
-                logging.debug(f"**Generating mask: {prov}")
-                msk = self.map.get_mask(self.provinces[prov].pos_xy)
-                masks.update({prov: msk})
-
+        save: bool = False
+
+        if (self.labels != None):
+            # Shared label raster, nothing to load
+            pass
+        elif len(self.mask_data.data) == 0:
+            # Missing, generate label raster
+            seeds: dict[str, tuple] = {prov: self.provinces[prov].pos_xy for prov in self.provinces}
+            self.labels = LabelMap.from_seeds(image=self.map.get_image(), seeds=seeds)
+            save = True
+        else:
+            # Load label raster, older files with one mask per province are rewritten as a raster
+            save = "__raster__" not in self.mask_data.data
+            self.labels = LabelMap.from_data(data=self.mask_data.data)
+
+        # Provinces added since the mask data was made
+        for prov in self.provinces:
+            if (prov not in self.labels.index):
+                logging.info(f"No mask for {prov}, generating")
+                self.add_label(name=prov)
+                save = True
+
+        if (save):
             # Push generated data to file
-            self.mask_data.data = masks
+            self.mask_data.data = self.labels.to_data()
             self.mask_data.write_data()
 
-            # Load mask data
-            self.masks = self.mask_data.data
-        else:
-            # Load mask data
-            self.masks = self.mask_data.data
-
         toc = time.perf_counter()
         logging.info(f"Mask loading completed! {toc - tic:0.4f}s")
 
+    def __load_reach(self) -> None:
+        '''Precompute hop distances, used by range queries'''
+        if (self.reach != None):
+            return # Shared
+        self.reset_reach()
+
+    def reset_reach(self) -> None:
+        '''Recompute hop distances, e.g. after adjacency changes. A shared Reach is replaced, not changed.'''
+        self.shared.discard("reach")
+        self.reach = Reach(provinces=self.provinces, ocean_provs=self.ocean_provs, sea_provs=self.sea_provs)
+
     def __load_data(self) -> None:
         '''Load all game data in the correct order'''
         self.__load_levels()
         self.__load_mapdata()
+        self.__load_reach()
         self.__load_players()
+        self.__load_stats()
         self.__load_masks()
+        if (self.atlas != None and self.map.has_names()):
+            logging.error(f"*** Province names are printed on the base image, not drawing labels. Use the image_no_names.png from map_refiner's clean stage as the base")
+            self.atlas = None
+            self.shared.discard("atlas")
+        if (self.atlas != None and len(self.atlas.placed) == 0):
+            self.place_labels()
+
+    def place_labels(self) -> None:
+        '''Place province names at their seed point, or at their centroid if the seed point is not inside the province'''
+        if ("atlas" in self.shared and len(self.atlas.placed) > 0):
+            self.atlas = self.atlas.copy()
+            self.shared.discard("atlas")
+        anchors: dict[str, tuple] = {}
+        for prov, province in self.provinces.items():
+            if (prov not in self.labels.index):
+                continue
+            x, y = province.pos_xy
+            inside: bool = 0 <= y < self.labels.shape[0] and 0 <= x < self.labels.shape[1]
+            if (inside and self.labels.raster[y, x] == self.labels.index[prov]):
+                anchors.update({prov: (x, y)})
+            else:
+                anchors.update({prov: self.labels.get_centroid(province=prov)})
+        self.atlas.place(labels=self.labels, anchors=anchors)
 
     def get_province_adjacents(self, province: Province) -> list[str]:
         '''Get adjacent provinces. Returns list of province names.
@@ -173,47 +308,244 @@ class Game:
 
         adjacents = list(dict.fromkeys(raw_adjacents)) # Dedupe into new list
 
+        unowned: list[str] = []
         for prov in adjacents:
             try:
                 provin = self.provinces[prov]
             except (KeyError):
+                unowned.append(prov)
                 continue # Not in the data list yet, move on for now.
 
-            if (provin.owner != None): # Remove if owned by anybody
-                adjacents.remove(prov)
+            if (provin.owner == None): # Keep only if owned by nobody
+                unowned.append(prov)
         
-        return adjacents
-    
+        return unowned
+
+    def get_province_at(self, x: float, y: float, size: tuple = None, nearest: bool = False) -> Province:
+        '''Get the province at a point on the map. Returns Province object, None if there is none.
+        :x: X position
+        :y: Y position
+        :size: (width, height) of the image the point is on, if it is scaled from the map
+        :nearest: If True, border and water pixels give the closest province'''
+        prov: str = self.labels.pick(x=x, y=y, size=size, nearest=nearest)
+        return self.provinces.get(prov) if prov != None else None
+
+    def get_provinces_at(self, points, size: tuple = None, nearest: bool = False) -> list[Province]:
+        '''Get the province at many points on the map. Returns list of Province objects, None where there is none.
+        :points: (n, 2) array-like of (x, y)
+        :size: (width, height) of the image the points are on, if it is scaled from the map
+        :nearest: If True, border and water pixels give the closest province'''
+        return [self.provinces.get(prov) if prov != None else None
+                for prov in self.labels.pick_many(points=points, size=size, nearest=nearest)]
+
+    def get_owned(self, player: Player) -> list[str]:
+        '''Get provinces owned by a player. Returns list of province names.
+        :player: Player object to check against'''
+        return [prov for prov in self.provinces if self.provinces[prov].owner == player]
+
+    def get_hops(self, player: Player, province: Province) -> int:
+        '''Get how many hops a province is from a player's territory. Returns None if unreachable.
+        :player: Player object to measure from
+        :province: Province object to reach'''
+        return self.reach.get_hops(owned=self.get_owned(player=player), target=province.name)
+
+    def get_reachable(self, player: Player, hops: int) -> list[str]:
+        '''Get provinces within some hops of a player's territory, e.g. what N claims could reach. Returns list of province names.
+        :player: Player object to measure from
+        :hops: Largest number of hops'''
+        return self.reach.get_reachable(owned=self.get_owned(player=player), hops=hops)
+
+    def get_frontier(self, owned: list[str]) -> tuple[set, set]:
+        '''Get provinces next to a set of provinces. Returns (directly adjacent names, all adjacent names incl. ocean/sea).
+        :owned: Province names to look around'''
+        direct: set = set()
+        reachable: set = set()
+        for prov in owned:
+            direct.update(self.provinces[prov].adjacent)
+            reachable.update(self.get_province_adjacents(province=self.provinces[prov]))
+        return direct, reachable
+
+    def get_claim_cost(self, province: Province, direct: bool) -> int:
+        '''Gets cost of claiming an unowned province. Returns cost as int.
+        :province: Province object from which to get cost
+        :direct: True if the claimant borders it directly, False if only by ocean/sea (double cost)'''
+        if (direct):
+            return province.level.cost
+        else:
+            return province.level.cost * 2
+
     def get_cost(self, province: Province, player: Player) -> int:
-        '''Gets cost of province claim. Returns cost as int.
+        '''Gets cost of province claim. Returns cost as int, 0 if it cannot be claimed.
         :province: Province object from which to get cost
         :player: Player object who wants the cost'''
-        adjacents: list[str] = self.get_player_adjacents(player=player)
-        if (province.owner == player):
-            return 0
-        elif (province.owner != None):
+        if (province.owner != None):
             return 0
 
-        if province.name in adjacents:
-            if province.name not in province.adjacent:
-                return province.level.cost * 2
-            else:
-                return province.level.cost
+        direct, reachable = self.get_frontier(owned=self.get_owned(player=player))
+        if province.name in reachable:
+            return self.get_claim_cost(province=province, direct=province.name in direct)
         else:
             return 0
 
+    def get_claim(self, province: Province, player: Player) -> int:
+        '''Check a single claim without applying it. Returns Claim status code.
+        :province: Province object being claimed
+        :player: Player object making the claim'''
+        tx = Transaction(game=self)
+        tx.add(player=player, province=province)
+        return tx.validate()[0].code
+
+    def transaction(self, atomic: bool = True, charge: bool = False) -> Transaction:
+        '''Start a batch of claims, see Transaction. Returns Transaction object.
+        :atomic: If True, one invalid claim rejects the whole batch
+        :charge: If True, claims are paid from player balances. Off by default, nothing credits balances yet.'''
+        return Transaction(game=self, atomic=atomic, charge=charge)
+
+    def highlight(self, provinces: list[str], color: tuple, width: int = 3) -> None:
+        '''Outline provinces on the current map, e.g. a selection. Cleared by the next fill.
+        :provinces: Province names to outline
+        :color: (r, g, b) outline color
+        :width: Outline thickness in pixels'''
+        self.map.draw_outlines(labels=self.labels, provinces=[p for p in provinces if p in self.provinces], color=color, width=width)
+
+    def highlight_frontier(self, player: Player, color: tuple = (255, 255, 255), width: int = 3) -> list[str]:
+        '''Outline the unowned provinces a player could claim next. Returns list of highlighted province names.
+        :player: Player object whose frontier to show
+        :color: (r, g, b) outline color
+        :width: Outline thickness in pixels'''
+        frontier: list[str] = [prov for prov in self.get_player_adjacents(player=player) if prov in self.provinces]
+        self.highlight(provinces=frontier, color=color, width=width)
+        return frontier
+
+    def get_colors(self) -> np.ndarray:
+        '''Get the current color of every province as a lookup table for the label raster. Returns (n + 1, 3) uint8 array.'''
+        colors = np.zeros((len(self.labels.names) + 1, 3), dtype=np.uint8)
+        for prov, i in self.labels.index.items():
+            if (prov in self.provinces):
+                colors[i] = self.provinces[prov].get_color().rgb
+        return colors
+
+    def get_snapshot(self) -> np.ndarray:
+        '''Get the visible state of every province, to diff against later. Returns (n + 1, 3) uint8 color lookup table.'''
+        return self.get_colors()
+
+    def get_changed(self, before: np.ndarray, after: np.ndarray = None) -> list[str]:
+        '''Get provinces whose color differs between two snapshots. Returns list of province names.
+        :before: Snapshot, see get_snapshot
+        :after: Later snapshot, None for the current state'''
+        after = self.get_snapshot() if after is None else after
+        changed = np.nonzero(np.any(before != after, axis=1))[0]
+        return [self.labels.names[i - 1] for i in changed if i > 0]
+
+    def get_bbox(self, provinces: list[str], margin: int = 16) -> tuple[int, int, int, int]:
+        '''Get the union bounding box of provinces, padded and clipped to the map. Returns (y0, y1, x0, x1), None if no province has pixels.
+        :provinces: Province names
+        :margin: Padding in pixels'''
+        boxes = [self.labels.bboxes[prov] for prov in provinces if prov in self.labels.bboxes]
+        if (len(boxes) == 0):
+            return None
+        height, width = self.labels.shape
+        return (max(min(b[0] for b in boxes) - margin, 0), min(max(b[1] for b in boxes) + margin, height),
+                max(min(b[2] for b in boxes) - margin, 0), min(max(b[3] for b in boxes) + margin, width))
+
+    def __render_crop(self, bbox: tuple, colors: np.ndarray) -> np.ndarray:
+        '''Render part of the map from a snapshot, with names if there is an atlas. Returns (h, w, 3) uint8 array.'''
+        y0, y1, x0, x1 = bbox
+        crop = self.map.get_crop(y0=y0, y1=y1, x0=x0, x1=x1)
+        raster = self.labels.raster[y0:y1, x0:x1]
+        inside = raster != 0
+        crop[inside] = colors[raster[inside]]
+        if (self.atlas != None):
+            # Names are clipped to their province, so only provinces in the crop can have names in it
+            ys, xs, ids = self.atlas.get_pixels(provinces=[self.labels.names[i - 1] for i in np.unique(raster) if i > 0])
+            keep = (ys >= y0) & (ys < y1) & (xs >= x0) & (xs < x1)
+            crop[ys[keep] - y0, xs[keep] - x0] = Atlas.get_contrast(colors=colors)[ids[keep]]
+        return crop
+
+    def render_diff(self, before: np.ndarray, after: np.ndarray = None, mode: str = "side", margin: int = 16,
+                    color: tuple = (255, 255, 255), width: int = 3, format: str = "PNG") -> bytes:
+        '''Render only the part of the map that changed between two snapshots. Cost is per pixel of the changed area, not the map.
+        Returns encoded image, None if nothing changed.
+        :before: Snapshot, see get_snapshot
+        :after: Later snapshot, None for the current state
+        :mode: "side" for before and after next to each other, "highlight" for after with changed provinces outlined
+        :margin: Padding around the changed provinces in pixels
+        :color: (r, g, b) outline color for "highlight", gap color for "side"
+        :width: Outline thickness for "highlight", gap width for "side"
+        :format: PIL image format'''
+        tic = time.perf_counter()
+        after = self.get_snapshot() if after is None else after
+        changed: list[str] = self.get_changed(before=before, after=after)
+        bbox = self.get_bbox(provinces=changed, margin=margin)
+        if (bbox == None):
+            return None
+        y0, y1, x0, x1 = bbox
+
+        image = self.__render_crop(bbox=bbox, colors=after)
+        if (mode == "highlight"):
+            for prov in changed:
+                ys, xs = self.labels.get_outline(province=prov, width=width)
+                image[ys - y0, xs - x0] = color
+        else:
+            gap = np.empty((y1 - y0, width, 3), dtype=np.uint8)
+            gap[:] = color
+            image = np.concatenate([self.__render_crop(bbox=bbox, colors=before), gap, image], axis=1)
+
+        data: bytes = Map.encode(array=image, format=format)
+        toc = time.perf_counter()
+        logging.info(f"Diff of {len(changed)} provinces, {x1 - x0}x{y1 - y0} {toc - tic:0.4f}s")
+        return data
+
     def update_map(self) -> None:
         '''Fill in map from latest data'''
         tic = time.perf_counter()
         self.map.add_players(players=self.players) # Send player data to map
         self.map.add_levels(levels=self.levels) # Send level data to map
         logging.info("Filling map from data...")
-        for prov in self.provinces.values():
-            self.map.fill_mask(mask=self.masks[prov.name], new_color=prov.get_color().rgb)
+        colors = self.get_colors()
+        self.map.fill_labels(labels=self.labels, colors=colors)
+        if (self.atlas != None):
+            self.map.draw_labels(atlas=self.atlas, colors=colors)
 
         toc = time.perf_counter()
         logging.info(f"Filling completed! {toc - tic:0.4f}s")
 
+    def update_provinces(self, provinces: list[str]) -> None:
+        '''Fill in only some provinces from latest data
+        :provinces: Province names to refill'''
+        tic = time.perf_counter()
+        self.map.add_players(players=self.players) # Send player data to map
+        self.map.add_levels(levels=self.levels) # Send level data to map
+        if (not self.map.has_image()):
+            # Working image was released, needs a full fill
+            self.update_map()
+            return
+        for prov in provinces:
+            self.map.fill_label(labels=self.labels, province=prov, new_color=self.provinces[prov].get_color().rgb)
+        if (self.atlas != None):
+            self.map.draw_labels(atlas=self.atlas, colors=self.get_colors(), provinces=provinces)
+
+        toc = time.perf_counter()
+        logging.info(f"Filling {len(provinces)} provinces completed! {toc - tic:0.4f}s")
+
+    def save_players(self, history: list[tuple] = None) -> bool:
+        '''Write ownership and balances back to player data. Fully owned regions are saved as regions. Returns True if written.
+        :history: Claims to record in the same write as (player key, province name, cost), at the current turn. Only kept by sqlite player data.'''
+        owned: dict[Player, dict[str, list[str]]] = {player: {"regions": [], "provinces": []} for player in self.players.values()}
+        for reg, region in self.regions.items():
+            owners = {prov.owner for prov in region.provinces.values()}
+            if (len(owners) == 1 and None not in owners):
+                owned[owners.pop()]["regions"].append(reg)
+            else:
+                for prov in region.provinces.values():
+                    if (prov.owner != None):
+                        owned[prov.owner]["provinces"].append(prov.name)
+
+        for play, player in self.players.items():
+            self.player_data.data[play]["owned"] = owned[player]
+            self.player_data.data[play]["balance"] = player.balance
+        return self.player_data.write_data(history=history, turn=self.turn)
+
     def start(self) -> None:
         '''Main loop'''
         # update map, write map
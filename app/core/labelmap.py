@@ -0,0 +1,284 @@
+# External
+import logging, time
+import numpy as np
+from scipy.ndimage import label, find_objects, distance_transform_edt
+
+
+class LabelMap:
+    '''Class for the province label raster, one integer label per pixel'''
+    def __init__(self, names: list[str], raster: np.ndarray) -> None:
+        '''Class for the province label raster, one integer label per pixel
+        :names: Province names, province names[i] has label i + 1
+        :raster: 2D integer array, 0 where no province is'''
+        self.names: list[str] = list(names)
+        self.index: dict[str, int] = {name: i + 1 for i, name in enumerate(self.names)}
+        self.raster: np.ndarray = raster
+        self.shape: tuple = raster.shape
+        self.bboxes: dict[str, tuple] = self.__get_bboxes()
+        self.nearest: np.ndarray = None # Nearest label for every pixel, built on first use
+        self.outlines: dict[str, np.ndarray] = None # Edge pixels per province, relative to its bbox, built on first use
+
+    @staticmethod
+    def get_dtype(count: int) -> np.dtype:
+        '''Get the smallest unsigned dtype that holds count labels plus 0
+        :count: Number of labels'''
+        if (count < 2**8): return np.uint8
+        if (count < 2**16): return np.uint16
+        return np.uint32
+
+    @classmethod
+    def from_masks(cls, masks: dict) -> "LabelMap":
+        '''Build a label raster from per-province boolean masks
+        :masks: dict (or NpzFile) of province name -> boolean mask'''
+        names: list[str] = list(masks.keys())
+        raster: np.ndarray = None
+        for i, name in enumerate(names):
+            mask = masks[name]
+            if (raster is None):
+                raster = np.zeros(mask.shape, dtype=LabelMap.get_dtype(len(names)))
+            raster[mask] = i + 1
+        if (raster is None):
+            raster = np.zeros((0, 0), dtype=np.uint8)
+        return cls(names=names, raster=raster)
+
+    @classmethod
+    def from_data(cls, data: dict) -> "LabelMap":
+        '''Build a label raster from saved data, see to_data. Older mask files with one mask per province are read too.
+        :data: dict (or NpzFile) from a mask file'''
+        if ("__raster__" not in data):
+            return cls.from_masks(masks=data)
+        return cls(names=[str(name) for name in data["__names__"]], raster=data["__raster__"])
+
+    def to_data(self) -> dict[str, np.ndarray]:
+        '''Get the raster and names for saving, one integer raster instead of a mask per province. Returns dict for Data.'''
+        return {"__raster__": self.raster, "__names__": np.array(self.names, dtype=str)}
+
+    @classmethod
+    def from_seeds(cls, image: np.ndarray, seeds: dict[str, tuple]) -> "LabelMap":
+        '''Build a label raster from an RGB image and a seed point per province.
+        Same result as Map.get_mask for every seed, with one connected-component pass per seed color.
+        :image: RGB image array, (h, w, 3)
+        :seeds: dict of province name -> (x, y) position inside the province'''
+        tic = time.perf_counter()
+        names: list[str] = list(seeds.keys())
+        raster = np.zeros(image.shape[:2], dtype=LabelMap.get_dtype(len(names)))
+        packed = image[..., 0].astype(np.uint32) << 16 | image[..., 1].astype(np.uint32) << 8 | image[..., 2]
+
+        # Group seeds by the color they sit on
+        by_color: dict[int, list[int]] = {}
+        for i, name in enumerate(names):
+            x, y = seeds[name]
+            by_color.setdefault(int(packed[y, x]), []).append(i)
+
+        for color, members in by_color.items():
+            components, _ = label(input=packed == color)
+            lookup = np.zeros(components.max() + 1, dtype=raster.dtype)
+            for i in members:
+                x, y = seeds[names[i]]
+                component = components[y, x]
+                if (lookup[component] != 0):
+                    logging.warning(f"Provinces {names[lookup[component] - 1]} and {names[i]} share a region, keeping {names[i]}")
+                lookup[component] = i + 1
+            hit = lookup[components]
+            raster[hit != 0] = hit[hit != 0]
+
+        toc = time.perf_counter()
+        logging.info(f"Label raster completed! {toc - tic:0.4f}s")
+        return cls(names=names, raster=raster)
+
+    def add(self, name: str, mask: np.ndarray) -> None:
+        '''Add a province to the raster. Pixels already labelled are left alone.
+        :name: Province name
+        :mask: Full-size boolean mask of the province'''
+        if (name in self.index):
+            return
+        self.names.append(name)
+        self.index.update({name: len(self.names)})
+        dtype = LabelMap.get_dtype(len(self.names))
+        if (np.dtype(dtype).itemsize > self.raster.dtype.itemsize):
+            self.raster = self.raster.astype(dtype)
+        self.raster[mask & (self.raster == 0)] = self.index[name]
+
+        rows, cols = np.flatnonzero(mask.any(axis=1)), np.flatnonzero(mask.any(axis=0))
+        if (len(rows) > 0):
+            self.bboxes.update({name: (int(rows[0]), int(rows[-1]) + 1, int(cols[0]), int(cols[-1]) + 1)})
+
+        # Derived rasters are rebuilt on next use
+        self.nearest = None
+        self.outlines = None
+
+    def copy(self) -> "LabelMap":
+        '''Get a copy that can be changed without touching this one, e.g. one shared between games. Returns LabelMap object.'''
+        labels = LabelMap.__new__(LabelMap)
+        labels.names = list(self.names)
+        labels.index = dict(self.index)
+        labels.raster = self.raster.copy()
+        labels.shape = self.shape
+        labels.bboxes = dict(self.bboxes)
+        labels.nearest = self.nearest # Replaced, not changed, by add
+        labels.outlines = self.outlines
+        return labels
+
+    def __get_bboxes(self) -> dict[str, tuple]:
+        '''Get bounding boxes of every province as (y0, y1, x0, x1)'''
+        bboxes: dict[str, tuple] = {}
+        for i, slc in enumerate(find_objects(self.raster, max_label=len(self.names))):
+            if (slc != None):
+                bboxes.update({self.names[i]: (slc[0].start, slc[0].stop, slc[1].start, slc[1].stop)})
+        return bboxes
+
+    def get_mask(self, province: str) -> np.ndarray:
+        '''Get the full-size boolean mask for a province
+        :province: Province name'''
+        return self.raster == self.index[province]
+
+    def __fill_holes(self) -> np.ndarray:
+        '''Get a copy of the raster where unlabelled areas enclosed by one province (lettering) take that province's label'''
+        holes, count = label(input=self.raster == 0)
+        found: list[np.ndarray] = []
+        for a, b in ((holes[:, :-1], self.raster[:, 1:]), (holes[:, 1:], self.raster[:, :-1]),
+                     (holes[:-1, :], self.raster[1:, :]), (holes[1:, :], self.raster[:-1, :])):
+            hit = (a != 0) & (b != 0)
+            found.append(np.unique(a[hit].astype(np.int64) * (len(self.names) + 1) + b[hit]))
+        pairs = np.unique(np.concatenate(found))
+        hole, prov = pairs // (len(self.names) + 1), pairs % (len(self.names) + 1)
+
+        # Holes touching exactly one province, and not the image edge
+        ids, counts = np.unique(hole, return_counts=True)
+        single = np.zeros(count + 1, dtype=bool)
+        single[ids[counts == 1]] = True
+        single[np.unique(np.concatenate((holes[[0, -1], :].ravel(), holes[:, [0, -1]].ravel())))] = False
+        fill = np.zeros(count + 1, dtype=self.raster.dtype)
+        fill[hole[single[hole]]] = prov[single[hole]]
+        fill[0] = 0
+        return np.where(self.raster == 0, fill[holes], self.raster)
+
+    def get_outlines(self) -> dict[str, np.ndarray]:
+        '''Get the edge pixels of every province as (k, 2) uint16 arrays of (y, x), relative to the province bbox.
+        Edge pixels are province pixels with a 4-neighbor outside the province. Built once, then cached.'''
+        if (self.outlines is None):
+            tic = time.perf_counter()
+            r = self.__fill_holes()
+            edge = np.zeros(r.shape, dtype=bool)
+            edge[:, :-1] |= r[:, :-1] != r[:, 1:]
+            edge[:, 1:] |= r[:, 1:] != r[:, :-1]
+            edge[:-1, :] |= r[:-1, :] != r[1:, :]
+            edge[1:, :] |= r[1:, :] != r[:-1, :]
+            edge[[0, -1], :] = True
+            edge[:, [0, -1]] = True
+            edge &= self.raster != 0
+
+            coords = np.argwhere(edge)
+            owner = self.raster[edge] # Same row-major order as argwhere
+            order = np.argsort(owner, kind="stable")
+            coords, owner = coords[order], owner[order]
+            bounds = np.searchsorted(owner, np.arange(1, len(self.names) + 2))
+
+            self.outlines = {}
+            for i, name in enumerate(self.names):
+                if (name in self.bboxes):
+                    y0, _, x0, _ = self.bboxes[name]
+                    self.outlines.update({name: (coords[bounds[i]:bounds[i + 1]] - (y0, x0)).astype(np.uint16)})
+            toc = time.perf_counter()
+            logging.info(f"Outlines completed! {toc - tic:0.4f}s")
+        return self.outlines
+
+    def get_outline(self, province: str, width: int = 1) -> tuple[np.ndarray, np.ndarray]:
+        '''Get the outline pixels of a province, width pixels thick and always inside the province. Returns (ys, xs) in map coordinates.
+        :province: Province name
+        :width: Thickness in pixels, grown inwards'''
+        if (province not in self.bboxes):
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        y0, y1, x0, x1 = self.bboxes[province]
+        ys = self.get_outlines()[province][:, 0].astype(np.int64) + y0
+        xs = self.get_outlines()[province][:, 1].astype(np.int64) + x0
+        if (width > 1):
+            # Grow around the edge, then keep only pixels of this province
+            offsets = np.arange(-(width - 1), width)
+            dy, dx = np.meshgrid(offsets, offsets, indexing="ij")
+            ys = np.clip((ys[:, None] + dy.ravel()[None, :]).ravel(), y0, y1 - 1)
+            xs = np.clip((xs[:, None] + dx.ravel()[None, :]).ravel(), x0, x1 - 1)
+            keep = self.raster[ys, xs] == self.index[province]
+            flat = np.unique(ys[keep] * self.shape[1] + xs[keep])
+            ys, xs = flat // self.shape[1], flat % self.shape[1]
+        return ys, xs
+
+    def get_centroid(self, province: str) -> tuple[int, int]:
+        '''Get the centroid of a province. Returns (x, y), None if the province has no pixels.
+        :province: Province name'''
+        if (province not in self.bboxes):
+            return None
+        y0, y1, x0, x1 = self.bboxes[province]
+        ys, xs = np.nonzero(self.raster[y0:y1, x0:x1] == self.index[province])
+        return int(round(xs.mean())) + x0, int(round(ys.mean())) + y0
+
+    def get_nearest(self) -> np.ndarray:
+        '''Get the nearest-label raster: every pixel holds the label of the closest province pixel. Built once, then cached.'''
+        if (self.nearest is None):
+            tic = time.perf_counter()
+            _, (iy, ix) = distance_transform_edt(input=self.raster == 0, return_indices=True)
+            self.nearest = self.raster[iy, ix]
+            toc = time.perf_counter()
+            logging.info(f"Nearest-label raster completed! {toc - tic:0.4f}s")
+        return self.nearest
+
+    def pick_many(self, points, size: tuple = None, nearest: bool = False) -> list[str]:
+        '''Get the province under many points at once. Returns list of province names, None where there is no province.
+        :points: (n, 2) array-like of (x, y)
+        :size: (width, height) of the image the points are on, if it is scaled from the map. Default is map size.
+        :nearest: If True, border, water and text pixels give the closest province instead of None'''
+        pts = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        height, width = self.shape
+        if (size != None):
+            pts = pts * (width / size[0], height / size[1])
+        xs = np.floor(pts[:, 0]).astype(np.int64)
+        ys = np.floor(pts[:, 1]).astype(np.int64)
+        inside = (xs >= 0) & (ys >= 0) & (xs < width) & (ys < height)
+
+        raster = self.get_nearest() if nearest else self.raster
+        found = np.zeros(len(pts), dtype=np.int64)
+        found[inside] = raster[ys[inside], xs[inside]]
+        return [self.names[f - 1] if f != 0 else None for f in found]
+
+    def pick(self, x: float, y: float, size: tuple = None, nearest: bool = False) -> str:
+        '''Get the province under a point. Returns province name, None if there is no province.
+        :x: X position
+        :y: Y position
+        :size: (width, height) of the image the point is on, if it is scaled from the map. Default is map size.
+        :nearest: If True, border, water and text pixels give the closest province instead of None'''
+        return self.pick_many(points=[(x, y)], size=size, nearest=nearest)[0]
+
+    def get_adjacency(self, border: int = 2) -> dict[str, list[str]]:
+        '''Derive adjacency from which labels touch across border pixels. Returns dict of province name -> sorted adjacent names.
+        :border: Widest border, in pixels, that two provinces may be separated by and still count as adjacent'''
+        tic = time.perf_counter()
+        n: int = len(self.names) + 1
+        r = self.raster
+        found: list[np.ndarray] = []
+
+        # Compare every pixel with the one d pixels right, down and diagonal
+        for d in range(1, border + 2):
+            for a, b in ((r[:, :-d], r[:, d:]),
+                         (r[:-d, :], r[d:, :]),
+                         (r[:-d, :-d], r[d:, d:]),
+                         (r[:-d, d:], r[d:, :-d])):
+                hit = (a != b) & (a != 0) & (b != 0)
+                lo = np.minimum(a[hit], b[hit]).astype(np.int64)
+                hi = np.maximum(a[hit], b[hit]).astype(np.int64)
+                found.append(np.unique(lo * n + hi))
+
+        adjacency: dict[str, list[str]] = {name: [] for name in self.names}
+        if (len(found) > 0):
+            for code in np.unique(np.concatenate(found)):
+                a, b = self.names[code // n - 1], self.names[code % n - 1]
+                adjacency[a].append(b)
+                adjacency[b].append(a)
+        for name in adjacency:
+            adjacency[name].sort()
+
+        toc = time.perf_counter()
+        logging.info(f"Adjacency completed! {toc - tic:0.4f}s")
+        return adjacency
+
+    def __repr__(self) -> str: return self.__str__() # Printable representation
+    def __str__(self) -> str: return f"LabelMap({len(self.names)} provinces, {self.shape[1]}x{self.shape[0]})" # String representation
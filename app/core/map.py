@@ -1,6 +1,6 @@
 #!/usr/bin/env python3
 # External
-import logging, time
+import io, logging, time
 from PIL import Image, ImageFont, ImageDraw
 import numpy as np
 from scipy.ndimage import label
@@ -8,29 +8,64 @@ from pathlib import Path
 # Internal
 from app.core.player import Player
 from app.core.province import LevelBase
+from app.core.labelmap import LabelMap
+from app.core.atlas import Atlas
+from app.core.tiles import Tiles
 
 
 class Map:
     '''Class for loading/creating/filling maps'''
-    def __init__(self, font: Path, in_image: Path, out_image: Path = None) -> None:
+    water: tuple = (229, 229, 229)  # Base image colors that are never a province
+    border: tuple = (102, 102, 102)
+    text: tuple = (28, 28, 28)      # Province names printed on the base image, inpainted by map_refiner's clean stage
+    base_colors: int = 64           # Most base image colors kept in indexed mode, the rest of the 256 are for fills, names and legend
+
+    def __init__(self, font: Path, in_image: Path, out_image: Path = None, base: np.ndarray = None, indexed: bool = False,
+                 tiles: Tiles = None) -> None:
         '''Class for loading/creating/filling maps
         :font: path to font for legend
         :in_image: path to base image
-        :out_image: path to output image'''
+        :out_image: path to output image
+        :base: already loaded base image to share between maps, read-only, see Map.load_base. The working copy is only made when filling.
+            An RGB base given with indexed is converted to palette form for this map.
+        :indexed: keep the image as a uint8 palette-index raster plus palette instead of RGB. The base is snapped to Map.base_colors colors,
+            the rest of the 256 hold fills, names, outlines and the legend. Falls back to RGB if those overflow.
+        :tiles: fill and encode PNG in horizontal tiles on this thread pool, can be shared between maps. None for one thread.'''
         self.font_path: Path = font.resolve()
         self.in_image_path: Path = in_image
         self.out_image_path: Path = out_image
         self.players: dict[str, Player] = {}
         self.levels: dict[str, LevelBase] = {}
+        self.base: np.ndarray = base
+        self.base_palette: np.ndarray = None
+        self.encoded: dict[str, bytes] = {} # Encoded output by format, cleared on every fill
+        self.tiles: Tiles = tiles
         
         # Check if output path set, if not set at input path
         if (self.out_image_path == None):
             out_stem: str = "out_" + self.in_image_path.stem
             self.out_image_path = self.in_image_path.with_stem(stem=out_stem).resolve()
 
-        # Load the input image
-        logging.info(f"Loading map image from file: {self.in_image_path}")
-        self.image: np.ndarray = self.__get_image_array(img_path=self.in_image_path)
+        # Working image: RGB, or palette indices plus palette
+        self.image: np.ndarray = None
+        self.indices: np.ndarray = None
+        self.palette: np.ndarray = None
+        self.lookup: dict[int, int] = {} # Packed color -> palette index
+        self.indexed: bool = indexed or isinstance(base, tuple)
+        if (isinstance(base, tuple)):
+            self.base, self.base_palette = base
+        elif (self.indexed and base is not None):
+            # RGB base, converted for this map only. Load it with Map.load_base(indexed=True) to share the palette form.
+            self.base, self.base_palette = Map.to_indexed(image=base)
+
+        # Load the input image, unless it is shared
+        if (self.base is None):
+            logging.info(f"Loading map image from file: {self.in_image_path}")
+            self.image = self.__get_image_array(img_path=self.in_image_path)
+            if (self.indexed):
+                self.indices, self.palette = Map.to_indexed(image=self.image)
+                self.image = None
+                self.__set_lookup()
 
     def __get_image_array(self, img_path: str) -> np.ndarray:
         '''Convert image to numpy array
@@ -41,7 +76,162 @@ class Map:
         # Convert image data to numpy array
         img_array = np.array(object=img) # returns np.ndarray object, basically just an array
         return img_array
-    
+
+    @staticmethod
+    def to_indexed(image: np.ndarray, limit: int = None) -> tuple:
+        '''Convert an RGB image to palette form. Past limit colors, rare colors (e.g. anti-aliased text) are snapped to the nearest common one.
+        Returns (uint8 index raster, (k, 3) uint8 palette).
+        :image: RGB image array
+        :limit: Most colors to keep, Map.base_colors if None'''
+        limit = Map.base_colors if limit == None else limit
+        packed = image[..., 0].astype(np.uint32) << 16 | image[..., 1].astype(np.uint32) << 8 | image[..., 2]
+        colors, inverse, counts = np.unique(packed, return_inverse=True, return_counts=True)
+        palette = np.column_stack(((colors >> 16) & 255, (colors >> 8) & 255, colors & 255)).astype(np.uint8)
+        inverse = inverse.reshape(packed.shape)
+        if (len(colors) <= limit):
+            return inverse.astype(np.uint8), palette
+
+        # Keep the most common colors, snap the rest to the nearest kept one
+        keep = np.sort(np.argsort(-counts, kind="stable")[:limit])
+        distance = ((palette[:, None, :].astype(np.int32) - palette[None, keep, :].astype(np.int32))**2).sum(axis=2)
+        remap = np.argmin(distance, axis=1).astype(np.uint8)
+        logging.info(f"Image has {len(colors)} colors, snapped {len(colors) - limit} rare ones, {counts.sum() - counts[keep].sum()} pixels")
+        return remap[inverse], palette[keep]
+
+    @staticmethod
+    def load_base(img_path: Path, indexed: bool = False):
+        '''Load a base image to share between maps. Returns read-only RGB array, or (index raster, palette) tuple if indexed.
+        :img_path: Path of image to load
+        :indexed: Load in palette form, keeping the Map.base_colors most common colors'''
+        logging.info(f"Loading shared map image from file: {img_path}")
+        img_array = np.array(object=Image.open(fp=img_path, mode="r").convert("RGB"))
+        if (indexed):
+            converted = Map.to_indexed(image=img_array)
+            for arr in converted:
+                arr.flags.writeable = False
+            return converted
+        img_array.flags.writeable = False
+        return img_array
+
+    def __set_lookup(self) -> None:
+        '''Rebuild the color -> palette index lookup'''
+        self.lookup = {int(r) << 16 | int(g) << 8 | int(b): i for i, (r, g, b) in enumerate(self.palette)}
+
+    def __get_indices(self) -> np.ndarray:
+        '''Get the working index raster, copying it from the shared base if it was released'''
+        if (self.indices is None):
+            self.indices = self.base.copy()
+            self.palette = self.base_palette.copy()
+            self.__set_lookup()
+        return self.indices
+
+    def __to_rgb(self) -> None:
+        '''Leave indexed mode, expanding the working image to RGB'''
+        logging.warning("Palette full, switching map to RGB")
+        self.image = self.palette[self.__get_indices()]
+        self.indices = None
+        self.palette = None
+        self.indexed = False
+        self.base = None # The working image no longer matches an indexed base, keep it
+
+    def __get_index(self, colors: np.ndarray) -> np.ndarray:
+        '''Get palette indexes for colors, adding new colors to the palette. Returns uint8 array, None if the palette is full.
+        :colors: (m, 3) array of colors'''
+        self.__get_indices()
+        colors = np.asarray(colors, dtype=np.uint8).reshape(-1, 3)
+        packed = [int(r) << 16 | int(g) << 8 | int(b) for r, g, b in colors]
+        new = [c for c in dict.fromkeys(packed) if c not in self.lookup]
+
+        if (len(self.palette) + len(new) > 256):
+            # Drop colors that are no longer on the image, then try again
+            used = np.unique(self.indices)
+            remap = np.zeros(len(self.palette), dtype=np.uint8)
+            remap[used] = np.arange(len(used))
+            self.indices = remap[self.indices]
+            self.palette = self.palette[used]
+            self.__set_lookup()
+            new = [c for c in dict.fromkeys(packed) if c not in self.lookup]
+            if (len(self.palette) + len(new) > 256):
+                return None
+
+        if (len(new) > 0):
+            added = np.array([((c >> 16) & 255, (c >> 8) & 255, c & 255) for c in new], dtype=np.uint8)
+            for i, c in enumerate(new):
+                self.lookup.update({c: len(self.palette) + i})
+            self.palette = np.concatenate((self.palette, added))
+        return np.array([self.lookup[c] for c in packed], dtype=np.uint8)
+
+    def get_image(self) -> np.ndarray:
+        '''Get the working image, copying it from the shared base if it was released.
+        In indexed mode this is an RGB expansion, writes to it do not reach the map.'''
+        if (self.indexed):
+            return self.palette[self.__get_indices()]
+        if (self.image is None):
+            self.image = self.base.copy()
+        return self.image
+
+    def get_crop(self, y0: int, y1: int, x0: int, x1: int) -> np.ndarray:
+        '''Get an RGB copy of part of the map, from the working image or the base if it was released. Cost is per cropped pixel.
+        :y0, y1, x0, x1: Crop rows and columns, end exclusive'''
+        if (self.indexed):
+            indices = self.indices if self.indices is not None else self.base
+            palette = self.palette if self.palette is not None else self.base_palette
+            return palette[indices[y0:y1, x0:x1]]
+        image = self.image if self.image is not None else self.base
+        return np.array(image[y0:y1, x0:x1], dtype=np.uint8)
+
+    def is_land(self, x: int, y: int, levels: dict[str, LevelBase]) -> bool:
+        '''Check if a point is on the map and on a province color, e.g. before using it as a province seed.
+        Unowned provinces are drawn in their level color, anything else is water, a border, a sea link or lettering.
+        :x, y: Point on the map
+        :levels: dict of levels, whose colors are land'''
+        working = self.indices if self.indices is not None else self.image
+        shape = (working if working is not None else self.base).shape
+        if (not (0 <= y < shape[0] and 0 <= x < shape[1])):
+            return False
+        color = tuple(int(c) for c in self.get_crop(y0=y, y1=y + 1, x0=x, x1=x + 1)[0, 0])
+        return color in {tuple(level.color.rgb) for level in levels.values()}
+
+    def has_names(self) -> bool:
+        '''Check if province names are printed on the base image, more than 1 in 10000 pixels in the lettering color'''
+        if (self.indexed):
+            indices = self.indices if self.indices is not None else self.base
+            palette = self.palette if self.palette is not None else self.base_palette
+            lettering = np.isin(indices, np.flatnonzero(np.all(palette == Map.text, axis=1)))
+        else:
+            image = self.image if self.image is not None else self.base
+            lettering = np.all(image == Map.text, axis=-1)
+        return int(lettering.sum()) > lettering.size // 10000
+
+    @staticmethod
+    def encode(array: np.ndarray, format: str = "PNG") -> bytes:
+        '''Encode an RGB array. Returns encoded bytes.
+        :array: (h, w, 3) uint8 array
+        :format: PIL image format'''
+        buffer = io.BytesIO()
+        Image.fromarray(obj=np.uint8(array)).save(buffer, format=format)
+        return buffer.getvalue()
+
+    def has_image(self) -> bool:
+        '''Check if a working image is loaded, False after release'''
+        return self.image is not None or self.indices is not None
+
+    def release(self) -> None:
+        '''Drop the working image and encoded output. Only possible when the base is shared.'''
+        if (self.base is not None):
+            self.image = None
+            self.indices = None
+            self.palette = None
+            self.encoded = {}
+
+    def get_memory(self) -> int:
+        '''Get bytes held by this map, not counting a shared base'''
+        total: int = sum(len(data) for data in self.encoded.values())
+        for arr in (self.image, self.indices, self.palette):
+            if (arr is not None):
+                total += arr.nbytes
+        return total
+
     def add_players(self, players: dict[str, Player]):
         '''Set players for map legend
         :players: dict with list of players'''
@@ -52,12 +242,52 @@ class Map:
         :levels: dict with list of levels'''
         self.levels = levels
 
+    def get_bytes(self, format: str = "PNG") -> bytes:
+        '''Encode map image with legend. Returns encoded bytes, cached until the next fill.
+        :format: PIL image format'''
+        if (format not in self.encoded):
+            self.draw_legend()
+            if (self.tiles != None and format.upper() == "PNG"):
+                if (self.indexed):
+                    self.encoded.update({format: self.tiles.encode_png(array=self.__get_indices(), palette=self.palette)})
+                else:
+                    self.encoded.update({format: self.tiles.encode_png(array=np.asarray(self.get_image(), dtype=np.uint8))})
+            else:
+                buffer = io.BytesIO()
+                self.__get_pil(format=format).save(buffer, format=format)
+                self.encoded.update({format: buffer.getvalue()})
+        return self.encoded[format]
+
+    def get_tiles(self, format: str = "WEBP", **params) -> list[tuple[int, bytes]]:
+        '''Encode the map as separate horizontal tiles in parallel. Returns list of (y0, encoded bytes), top to bottom.
+        :format: PIL image format, WebP by default as its streams can't be joined into one image
+        :params: Encoder options, lossless WebP by default'''
+        self.draw_legend()
+        tiles: Tiles = self.tiles if self.tiles != None else Tiles(workers=1)
+        return tiles.encode_tiles(image=self.__get_pil(format=format), format=format, **(params or {"lossless": True}))
+
+    def __get_pil(self, format: str) -> Image.Image:
+        '''Get the working image as a PIL image. Indexed maps stay in palette mode for formats that support it.
+        :format: PIL image format that will be written'''
+        if (self.indexed):
+            img = Image.fromarray(obj=self.__get_indices(), mode="P")
+            img.putpalette(data=self.palette.flatten().tolist())
+            if (format.upper() not in ("PNG", "GIF", "BMP", "TIFF")):
+                img = img.convert("RGB")
+            return img
+        return Image.fromarray(obj=np.uint8(self.get_image()))
+
     def write(self, dest: Path = None) -> None:
         '''Write map image to destination
         :dest: Destination path for the image'''
         # Convert array to image
         self.draw_legend()
-        new_image = Image.fromarray(obj=np.uint8(self.image))
+        dest_path: Path = self.out_image_path if dest == None else dest
+        if (self.tiles != None and dest_path.suffix.lower() == ".png"):
+            logging.info(f"Writing map to {dest_path.__str__()}")
+            dest_path.write_bytes(self.get_bytes(format="PNG"))
+            return
+        new_image = self.__get_pil(format=Image.registered_extensions().get(dest_path.suffix.lower(), "PNG"))
 
         # Save the output image
         if (dest == None): 
@@ -71,11 +301,14 @@ class Map:
         '''Get the mask for a province
         :seed_point: (x,y) position inside a province'''
 
-        # Get color at the seed_point
-        seed_color = self.image[seed_point[1], seed_point[0]] # [y, x]
-
         # Generate a binary mask where pixels match the seed color
-        mask = np.all(self.image == seed_color, axis=-1)
+        if (self.indexed):
+            indices = self.__get_indices()
+            mask = indices == indices[seed_point[1], seed_point[0]] # [y, x]
+        else:
+            image = self.get_image()
+            seed_color = image[seed_point[1], seed_point[0]] # [y, x]
+            mask = np.all(image == seed_color, axis=-1)
 
         # Label all connected regions in the mask
         labeled_array, _ = label(input=mask)
@@ -90,7 +323,101 @@ class Map:
     
     def fill_mask(self, mask: np.ndarray, new_color: tuple) -> None:
         # Generate a new image, replacing the selected region color
-        self.image[mask] = new_color
+        self.encoded = {}
+        if (self.indexed):
+            index = self.__get_index(colors=[new_color])
+            if (index is not None):
+                self.indices[mask] = index[0]
+                return
+            self.__to_rgb()
+        self.get_image()[mask] = new_color
+
+    def fill_labels(self, labels: LabelMap, colors: np.ndarray) -> None:
+        '''Fill every province at once from a color lookup table
+        :labels: Province label raster
+        :colors: (provinces + 1, 3) uint8 array, row i is the color of label i. Row 0 is unused.'''
+        self.encoded = {}
+        lut = colors
+        target = self.get_image
+        if (self.indexed):
+            index = self.__get_index(colors=colors)
+            if (index is not None):
+                lut = index
+                target = self.__get_indices
+            else:
+                self.__to_rgb()
+        array = target()
+
+        def fill(y0: int, y1: int) -> None:
+            raster = labels.raster[y0:y1]
+            inside = raster != 0
+            array[y0:y1][inside] = lut[raster[inside]]
+
+        if (self.tiles != None):
+            self.tiles.run(func=fill, height=labels.shape[0])
+        else:
+            fill(0, labels.shape[0])
+
+    def fill_label(self, labels: LabelMap, province: str, new_color: tuple) -> None:
+        '''Fill one province, only touching its bounding box
+        :labels: Province label raster
+        :province: Province name
+        :new_color: (r, g, b) color'''
+        if (province not in labels.bboxes):
+            return
+        self.encoded = {}
+        y0, y1, x0, x1 = labels.bboxes[province]
+        inside = labels.raster[y0:y1, x0:x1] == labels.index[province]
+        if (self.indexed):
+            index = self.__get_index(colors=[new_color])
+            if (index is not None):
+                self.indices[y0:y1, x0:x1][inside] = index[0]
+                return
+            self.__to_rgb()
+        self.get_image()[y0:y1, x0:x1][inside] = new_color
+
+    def draw_outlines(self, labels: LabelMap, provinces: list[str], color: tuple, width: int = 1) -> None:
+        '''Draw outlines of provinces, e.g. to highlight a selection or a frontier. Cost is per outline pixel, not per map pixel.
+        Outlines are drawn inside the provinces, so the next fill clears them.
+        :labels: Province label raster
+        :provinces: Province names to outline
+        :color: (r, g, b) outline color
+        :width: Outline thickness in pixels'''
+        tic = time.perf_counter()
+        self.encoded = {}
+        parts = [labels.get_outline(province=prov, width=width) for prov in provinces]
+        if (len(parts) == 0):
+            return
+        ys = np.concatenate([p[0] for p in parts])
+        xs = np.concatenate([p[1] for p in parts])
+
+        if (self.indexed):
+            index = self.__get_index(colors=[color])
+            if (index is not None):
+                self.indices[ys, xs] = index[0]
+                return
+            self.__to_rgb()
+        self.get_image()[ys, xs] = color
+        toc = time.perf_counter()
+        logging.debug(f"Outlined {len(provinces)} provinces, {len(ys)} pixels {toc - tic:0.4f}s")
+
+    def draw_labels(self, atlas: Atlas, colors: np.ndarray, provinces: list[str] = None) -> None:
+        '''Draw province names from placed atlas sprites, black or white against each fill. Drawn inside the provinces, so the next fill clears them.
+        :atlas: Atlas with labels placed
+        :colors: (provinces + 1, 3) uint8 fill color lookup table, see fill_labels
+        :provinces: Only draw these provinces, None for all'''
+        ys, xs, ids = atlas.get_pixels(provinces=provinces)
+        if (len(ys) == 0):
+            return
+        self.encoded = {}
+        text = Atlas.get_contrast(colors=colors)
+        if (self.indexed):
+            index = self.__get_index(colors=text)
+            if (index is not None):
+                self.indices[ys, xs] = index[ids]
+                return
+            self.__to_rgb()
+        self.get_image()[ys, xs] = text[ids]
 
     def draw_legend(self) -> None:
         '''Draw legend of players and their colors on the map'''
@@ -110,6 +437,8 @@ class Map:
 
         i = Image.new("RGB", (imgWidth, imgHeight), (0,0,0))
         a = ImageDraw.Draw(i)
+        if (self.indexed):
+            a.fontmode = "1" # No anti-aliasing, every shade would take a palette entry
         font = ImageFont.truetype(font=self.font_path.__str__(), size=14)
 
         for outer, playername in enumerate(self.players):
@@ -129,4 +458,11 @@ class Map:
                     a.text((x1+1, y0+10), player.name, fill='white', font=font)
 
         legend = np.array(object=i)
-        self.image[-legend.shape[0]:, 0:legend.shape[1]] = legend
\ No newline at end of file
+        if (self.indexed):
+            colors, inverse = np.unique(legend.reshape(-1, 3), axis=0, return_inverse=True)
+            index = self.__get_index(colors=colors)
+            if (index is not None):
+                self.indices[-legend.shape[0]:, 0:legend.shape[1]] = index[inverse.ravel()].reshape(legend.shape[:2])
+                return
+            self.__to_rgb()
+        self.get_image()[-legend.shape[0]:, 0:legend.shape[1]] = legend
\ No newline at end of file
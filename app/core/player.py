@@ -18,6 +18,14 @@ class Player:
         self.color: ColorBase = color
         self.colors: dict[str, ColorBase] = self.__get_colors(base=self.color, levels=levels)
 
+    def update_colors(self, levels: dict[str, LevelBase], color: ColorBase = None) -> None:
+        '''Regenerate level colors, e.g. after levels or the base color change
+        :levels: dict of all levels
+        :color: New base color, keeps the current one if not set'''
+        if (color != None):
+            self.color = color
+        self.colors = self.__get_colors(base=self.color, levels=levels)
+
     def __get_colors(self, base: ColorBase, levels: dict[str, LevelBase]) -> dict:
         '''Generate colors for each level'''
         logging.debug(f"Generating colors for {self.name} based on: {base.name} - {str(base.rgb)}")
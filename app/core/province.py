@@ -1,5 +1,6 @@
 # External
 import logging
+from typing import Callable
 # Internal
 from app.core.player import Player
 from app.core.color import ColorBase
@@ -37,12 +38,25 @@ class Province:
         self.ocean: bool = False
         self.sea: bool = False
         self.seas: list[str] = []
+        self.listeners: list[Callable] = [] # Called as listener(province, old_owner, old_level) after every change
 
     def update_owner(self, owner: Player) -> None:
         '''Update the owner of a province
         :owner: Player object to assign as owner'''
-        logging.debug(f"Updating owner for {self.name} to {owner.name}")
+        logging.debug(f"Updating owner for {self.name} to {owner.name if owner != None else None}")
+        old_owner: Player = self.owner
         self.owner = owner
+        for listener in self.listeners:
+            listener(self, old_owner, self.level)
+
+    def update_level(self, level: LevelBase) -> None:
+        '''Update the level of a province
+        :level: Level object to assign'''
+        logging.debug(f"Updating level for {self.name} to {level.name}")
+        old_level: LevelBase = self.level
+        self.level = level
+        for listener in self.listeners:
+            listener(self, self.owner, old_level)
 
     def add_adjacent(self, province: str) -> None:
         '''Add an adjacent province by name
@@ -59,7 +73,7 @@ class Province:
             return self.level.color
     
     def __repr__(self) -> str: return self.__str__() # Printable representation
-    def __str__(self) -> str: return str(self.__dict__) # String representation
+    def __str__(self) -> str: return str({k: v for k, v in self.__dict__.items() if k != "listeners"}) # String representation
 
 class Region:
     '''Class for working with regions'''
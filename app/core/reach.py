@@ -0,0 +1,131 @@
+# External
+import logging, time
+import numpy as np
+# Internal
+from app.core.province import Province
+
+
+class Reach:
+    '''Hop distances between provinces over the effective adjacency graph (direct, ocean and sea links)'''
+    UNREACHABLE: int = np.iinfo(np.uint16).max
+
+    def __init__(self, provinces: dict[str, Province], ocean_provs: list[str], sea_provs: dict[str, list[str]],
+                 dense_limit: int = 4096) -> None:
+        '''Hop distances between provinces over the effective adjacency graph (direct, ocean and sea links)
+        :provinces: dict of all provinces
+        :ocean_provs: Ocean-accessible province names, all linked to each other
+        :sea_provs: dict of sea name -> province names, linked to each other
+        :dense_limit: Largest province count for which the full distance matrix is kept, above it rows are computed per query'''
+        tic = time.perf_counter()
+        self.names: list[str] = list(provinces.keys())
+        self.index: dict[str, int] = {name: i for i, name in enumerate(self.names)}
+
+        # Direct links as CSR, dropping names that are not in the data yet
+        rows: list[list[int]] = [[self.index[adj] for adj in provinces[name].adjacent if adj in self.index and adj != name]
+                                 for name in self.names]
+        self.indptr: np.ndarray = np.zeros(len(rows) + 1, dtype=np.int64)
+        self.indptr[1:] = np.cumsum([len(row) for row in rows])
+        self.indices: np.ndarray = np.array([i for row in rows for i in row], dtype=np.int64)
+
+        # Ocean and seas as groups, so they link their members without a quadratic number of edges
+        groups: list[list[int]] = [[self.index[p] for p in ocean_provs if p in self.index]]
+        groups += [[self.index[p] for p in members if p in self.index] for members in sea_provs.values()]
+        membership: list[list[int]] = [[] for _ in self.names]
+        for g, members in enumerate(groups):
+            for i in members:
+                membership[i].append(g)
+        self.group_members: list[np.ndarray] = [np.array(members, dtype=np.int64) for members in groups]
+        self.group_indptr: np.ndarray = np.zeros(len(membership) + 1, dtype=np.int64)
+        self.group_indptr[1:] = np.cumsum([len(m) for m in membership])
+        self.group_indices: np.ndarray = np.array([g for m in membership for g in m], dtype=np.int64)
+
+        # All-pairs matrix when it fits, otherwise single-source rows are cached as they are asked for
+        self.matrix: np.ndarray = None
+        self.rows: dict[int, np.ndarray] = {}
+        if (len(self.names) <= dense_limit):
+            self.matrix = np.stack([self.__bfs(sources=np.array([i])) for i in range(len(self.names))]) \
+                if len(self.names) > 0 else np.zeros((0, 0), dtype=np.uint16)
+
+        toc = time.perf_counter()
+        logging.info(f"Reach completed! {toc - tic:0.4f}s")
+
+    @staticmethod
+    def __gather(indptr: np.ndarray, indices: np.ndarray, nodes: np.ndarray) -> np.ndarray:
+        '''Concatenate the CSR rows of several nodes'''
+        starts = indptr[nodes]
+        lengths = indptr[nodes + 1] - starts
+        total = int(lengths.sum())
+        if (total == 0):
+            return np.zeros(0, dtype=np.int64)
+        offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+        return indices[offsets + np.arange(total)]
+
+    def __bfs(self, sources: np.ndarray) -> np.ndarray:
+        '''Multi-source BFS, one layer per step. Returns uint16 hop counts, UNREACHABLE where not reachable.
+        :sources: Province indexes at distance 0'''
+        dist = np.full(len(self.names), Reach.UNREACHABLE, dtype=np.uint16)
+        if (len(sources) == 0):
+            return dist
+        dist[sources] = 0
+        used = np.zeros(len(self.group_members), dtype=bool)
+        frontier = np.unique(sources)
+        hops: int = 0
+
+        while (len(frontier) > 0):
+            hops += 1
+            step = [Reach.__gather(self.indptr, self.indices, frontier)]
+            groups = np.unique(Reach.__gather(self.group_indptr, self.group_indices, frontier))
+            groups = groups[~used[groups]]
+            used[groups] = True
+            step += [self.group_members[g] for g in groups]
+
+            nxt = np.unique(np.concatenate(step))
+            nxt = nxt[dist[nxt] == Reach.UNREACHABLE]
+            dist[nxt] = hops
+            frontier = nxt
+
+        return dist
+
+    def __row(self, i: int) -> np.ndarray:
+        '''Get the distance row of one province'''
+        if (self.matrix is not None):
+            return self.matrix[i]
+        if (i not in self.rows):
+            self.rows.update({i: self.__bfs(sources=np.array([i]))})
+        return self.rows[i]
+
+    def get_distances(self, owned: list[str]) -> np.ndarray:
+        '''Get hops from the nearest owned province to every province, in self.names order. Returns uint16 array.
+        :owned: Province names to measure from'''
+        sources = np.array([self.index[p] for p in owned if p in self.index], dtype=np.int64)
+        if (len(sources) == 0):
+            return np.full(len(self.names), Reach.UNREACHABLE, dtype=np.uint16)
+        if (self.matrix is not None):
+            return self.matrix[sources].min(axis=0)
+        if (len(sources) == 1):
+            return self.__row(int(sources[0]))
+        return self.__bfs(sources=sources)
+
+    def get_distance(self, source: str, target: str) -> int:
+        '''Get hops between two provinces. Returns None if unreachable.
+        :source: Province name to start from
+        :target: Province name to reach'''
+        hops = int(self.__row(self.index[source])[self.index[target]])
+        return None if hops == Reach.UNREACHABLE else hops
+
+    def get_hops(self, owned: list[str], target: str) -> int:
+        '''Get hops from the nearest owned province to a province. Returns None if unreachable.
+        :owned: Province names to measure from
+        :target: Province name to reach'''
+        hops = int(self.get_distances(owned=owned)[self.index[target]])
+        return None if hops == Reach.UNREACHABLE else hops
+
+    def get_reachable(self, owned: list[str], hops: int) -> list[str]:
+        '''Get provinces within some hops of the owned provinces, not counting the owned ones. Returns list of province names.
+        :owned: Province names to measure from
+        :hops: Largest number of hops, e.g. number of claims'''
+        dist = self.get_distances(owned=owned)
+        return [self.names[i] for i in np.flatnonzero((dist > 0) & (dist <= hops))]
+
+    def __repr__(self) -> str: return self.__str__() # Printable representation
+    def __str__(self) -> str: return f"Reach({len(self.names)} provinces, {'dense' if self.matrix is not None else 'sparse'})" # String representation
@@ -0,0 +1,125 @@
+# External
+import logging, shutil, time
+from collections import OrderedDict
+from pathlib import Path
+# Internal
+from app.core.data import Data
+from app.core.map import Map
+from app.core.game import Game
+from app.core.labelmap import LabelMap
+from app.core.reach import Reach
+from app.core.atlas import Atlas
+from app.core.tiles import Tiles
+
+
+class Registry:
+    '''Hosts many games on one map. Map assets are loaded once and shared read-only, idle games are saved to disk and dropped.'''
+    def __init__(self, font: Path, image: Path, leveld: Data, mapd: Data, maskd: Data, players: Path, root: Path,
+                 budget: int = 512 * 2**20, indexed: bool = False, labelled: bool = False,
+                 workers: int = 1) -> None:
+        '''Hosts many games on one map. Map assets are loaded once and shared read-only, idle games are saved to disk and dropped.
+        :font: path to font for legend
+        :image: path to base image
+        :leveld: Level data, shared
+        :mapd: Map data, shared
+        :maskd: Mask data, only read once to build the shared label raster
+        :players: Player data file that new games start from
+        :root: Directory for per-game player data and output images
+        :budget: Bytes of per-game working images and encoded output to keep before evicting idle games
+        :indexed: Keep the base and working images in palette form, see Map
+        :labelled: Draw province names, from one atlas shared by every game
+        :workers: Threads to fill and encode in tiles, shared by every game. 0 for one per core.'''
+        self.font_path: Path = font
+        self.image_path: Path = image
+        self.level_data: Data = leveld
+        self.map_data: Data = mapd
+        self.mask_data: Data = maskd
+        self.players_path: Path = players
+        self.root: Path = root
+        self.budget: int = budget
+        self.games: OrderedDict[str, Game] = OrderedDict() # Least recently used first
+
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.base = Map.load_base(img_path=self.image_path, indexed=indexed)
+        self.labels: LabelMap = None # Taken from the first game loaded
+        self.reach: Reach = None
+        self.atlas: Atlas = Atlas(font=self.font_path) if labelled else None
+        self.tiles: Tiles = Tiles(workers=workers or None) if workers != 1 else None
+
+    def __get_path(self, key: str) -> Path:
+        '''Get player data path of a game'''
+        return self.root / f"{key}.json"
+
+    def get(self, key: str) -> Game:
+        '''Get a game, loading it from disk or starting it from the player template if needed. Returns Game object.
+        :key: Game id, e.g. server or channel id'''
+        if (key in self.games):
+            self.games.move_to_end(key)
+            return self.games[key]
+
+        tic = time.perf_counter()
+        path: Path = self.__get_path(key=key)
+        if (not path.exists()):
+            logging.info(f"Starting new game {key} from {self.players_path.__str__()}")
+            shutil.copyfile(src=self.players_path, dst=path)
+
+        game = Game(leveld=self.level_data,
+                    maskd=self.mask_data,
+                    mapd=self.map_data,
+                    playerd=Data(file=path, source=Data.Source.json),
+                    map=Map(font=self.font_path, in_image=self.image_path, out_image=self.root / f"{key}.png", base=self.base,
+                            tiles=self.tiles),
+                    labels=self.labels,
+                    reach=self.reach,
+                    atlas=self.atlas)
+        self.labels = game.labels
+        self.reach = game.reach
+        self.atlas = game.atlas # None if the base has names printed on it, no need to check again
+        game.shared.update(("labels", "reach", "atlas")) # Also for the first game, whose own copies are now shared
+        self.games.update({key: game})
+
+        toc = time.perf_counter()
+        logging.info(f"Game {key} loaded! {toc - tic:0.4f}s")
+        self.trim()
+        return game
+
+    def evict(self, key: str) -> bool:
+        '''Save a game to disk and drop it from memory. Returns False if saving failed, the game is then kept loaded.
+        :key: Game id'''
+        logging.info(f"Evicting game {key}")
+        game = self.games[key]
+        if (not game.save_players()):
+            logging.error(f"*** Could not save game {key}, keeping it loaded")
+            return False
+        self.games.pop(key)
+        game.map.release()
+        return True
+
+    def get_memory(self) -> int:
+        '''Get bytes held by loaded games, not counting shared assets'''
+        return sum(game.map.get_memory() for game in self.games.values())
+
+    def trim(self) -> None:
+        '''Evict least recently used games until under budget. The most recently used game is always kept, as are games that could not be saved.'''
+        for key in list(self.games)[:-1]:
+            if (self.get_memory() <= self.budget):
+                return
+            self.evict(key=key)
+
+    def render(self, key: str, format: str = "PNG") -> bytes:
+        '''Render a game map, filling it in full only if its working image is not loaded. Returns encoded image, cached by the map until its next fill.
+        :key: Game id
+        :format: PIL image format'''
+        game = self.get(key=key)
+        if (not game.map.has_image()):
+            game.update_map()
+        data: bytes = game.map.get_bytes(format=format)
+        self.trim()
+        return data
+
+    def close(self) -> None:
+        '''Save and drop every game. Games that could not be saved stay loaded.'''
+        for key in list(self.games):
+            self.evict(key=key)
+        if (self.tiles != None):
+            self.tiles.close()
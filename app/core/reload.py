@@ -0,0 +1,275 @@
+# External
+import logging, threading, time
+from pathlib import Path
+# Internal
+from app.core.data import Data
+from app.core.game import Game
+from app.core.color import ColorBase
+from app.core.level import LevelBase
+from app.core.scheduler import Scheduler
+
+
+class Reloader:
+    '''Reloads level, player and map data into a running game, only redoing what changed'''
+    def __init__(self, game: Game, scheduler: Scheduler = None) -> None:
+        '''Reloads level, player and map data into a running game, only redoing what changed
+        :game: Game to reload into
+        :scheduler: Scheduler rendering the game. Reloads hold its lock and notify it instead of refilling the map. None to refill here.'''
+        self.game: Game = game
+        self.scheduler: Scheduler = scheduler
+        self.lock: threading.RLock = scheduler.lock if scheduler != None else threading.RLock() # Held while reloading, hold it to use the game from another thread
+        self.mtimes: dict[str, float] = {kind: self.__get_mtime(path=data.path) for kind, data in self.__get_sources().items()}
+        self.refill: set[str] = set() # Provinces to refill after the reload
+        self.full: bool = False       # Full refill needed after the reload
+        self.legend: bool = False     # Players were added, removed or renamed, the legend needs redrawing
+        self.thread: threading.Thread = None
+        self.stop_event: threading.Event = threading.Event()
+
+    def __get_sources(self) -> dict[str, Data]:
+        '''Get the data sources being followed, by kind'''
+        return {"levels": self.game.level_data, "players": self.game.player_data, "map": self.game.map_data}
+
+    @staticmethod
+    def __get_mtime(path: Path) -> float:
+        '''Get modification time of a file, 0 if missing. Counts the write-ahead log of sqlite files, where changes land first.'''
+        mtime: float = 0.0
+        for file in (path, path.with_name(path.name + "-wal")):
+            try:
+                mtime = max(mtime, file.stat().st_mtime)
+            except OSError:
+                pass
+        return mtime
+
+    @staticmethod
+    def __read(old: Data) -> Data:
+        '''Read a fresh copy of a data source. Returns None if it could not be read.'''
+        new = Data(file=old.path, source=old.source)
+        if (new.data == {}):
+            logging.warning(f"Reload skipped, no data in {old.path.__str__()}")
+            new.close()
+            return None
+        return new
+
+    def reload_levels(self) -> list[str]:
+        '''Reload level data. Costs and products are updated in place, color changes regenerate player colors. Returns list of changes.'''
+        new = Reloader.__read(old=self.game.level_data)
+        if (new == None):
+            return []
+        changes: list[str] = []
+        recolor: bool = False
+        reprice: bool = False
+
+        names: list[str] = []
+        for entry in new.data.values():
+            name: str = entry["name"]
+            names.append(name)
+            r, g, b = entry["color"]
+            if (name not in self.game.levels):
+                self.game.levels.update({name: LevelBase(name=name, cost=entry["cost"], product=entry["product"],
+                                                         color=ColorBase(name=name, rgb=(r, g, b)))})
+                changes.append(f"level {name} added")
+                recolor = True
+                continue
+
+            level: LevelBase = self.game.levels[name]
+            if (level.cost != entry["cost"]):
+                level.cost = entry["cost"]
+                changes.append(f"level {name} cost")
+            if (level.product != entry["product"]):
+                level.product = entry["product"]
+                changes.append(f"level {name} product")
+                reprice = True
+            if (level.color.rgb != (r, g, b)):
+                level.color = ColorBase(name=name, rgb=(r, g, b))
+                changes.append(f"level {name} color")
+                recolor = True
+
+        for name in list(self.game.levels):
+            if (name in names):
+                continue
+            if (any(prov.level.name == name for prov in self.game.provinces.values())):
+                logging.warning(f"Level {name} removed from data but still in use, keeping it")
+            else:
+                self.game.levels.pop(name)
+                changes.append(f"level {name} removed")
+                recolor = True
+
+        if (recolor):
+            self.full = True
+            for player in self.game.players.values():
+                player.update_colors(levels=self.game.levels)
+        if (reprice):
+            self.game.stats.rebuild()
+        self.game.level_data = new
+        return changes
+
+    def reload_players(self) -> list[str]:
+        '''Reload player data. Only provinces whose owner differs are updated. Returns list of changes.'''
+        new = Reloader.__read(old=self.game.player_data)
+        if (new == None):
+            return []
+        changes: list[str] = []
+        recolored: set = set() # Players whose provinces need refilling in their new color
+
+        for key, entry in new.data.items():
+            if (key not in self.game.players):
+                self.game.add_player(key=key, data=entry)
+                changes.append(f"player {key} added")
+                self.legend = True
+                continue
+            player = self.game.players[key]
+            if (player.name != entry["name"]):
+                player.name = entry["name"]
+                changes.append(f"player {key} name")
+                self.legend = True
+            player.snowflake = entry["snowflake"]
+            if ("balance" in entry and player.balance != entry["balance"]):
+                player.balance = entry["balance"]
+                changes.append(f"player {key} balance")
+            color: ColorBase = Game.get_player_color(key=key, data=entry)
+            if (color.rgb != player.color.rgb):
+                player.update_colors(levels=self.game.levels, color=color)
+                changes.append(f"player {key} color")
+                recolored.add(player)
+                self.legend = True
+
+        removed: list[str] = [key for key in self.game.players if key not in new.data]
+        for key in removed:
+            changes.append(f"player {key} removed")
+            self.legend = True
+
+        # Apply only ownership differences
+        wanted: dict[str, str] = {}
+        for key, entry in new.data.items():
+            for prov in self.game.get_holdings(data=entry):
+                wanted.update({prov: key})
+        for name, province in self.game.provinces.items():
+            owner = self.game.players[wanted[name]] if name in wanted else None
+            if (province.owner != owner):
+                province.update_owner(owner=owner)
+                changes.append(f"province {name} owner")
+                self.refill.add(name)
+            elif (owner in recolored):
+                self.refill.add(name)
+
+        for key in removed:
+            self.game.players.pop(key)
+        self.game.turn = max(self.game.turn, new.get_turn()) # Another process may have played turns
+        self.game.player_data.close()
+        self.game.player_data = new
+        return changes
+
+    def reload_map(self) -> list[str]:
+        '''Reload map data. New provinces are labelled from their seed point, changed ones are updated in place. Returns list of changes.'''
+        new = Reloader.__read(old=self.game.map_data)
+        if (new == None):
+            return []
+        old: dict[str, dict] = {prov: entry for reg in self.game.map_data.data for prov, entry in self.game.map_data.data[reg].items()}
+        changes: list[str] = []
+        added: list[str] = []
+        seen: set = set()
+        topology: bool = False # Adjacency, ocean or sea access changed, hop distances need rebuilding
+
+        for reg in new.data:
+            for name, entry in new.data[reg].items():
+                seen.add(name)
+                if (name not in self.game.provinces):
+                    self.game.add_province(region=reg, name=name, data=entry)
+                    self.game.add_label(name=name)
+                    added.append(name)
+                    self.refill.add(name)
+                    topology = True
+                    changes.append(f"province {name} added")
+                    continue
+                if (entry == old.get(name)):
+                    continue
+                if (name not in self.game.regions[reg].provinces):
+                    logging.warning(f"Province {name} moved to region {reg}, needs a restart")
+                if (list(entry["pos"]) != list(self.game.provinces[name].pos_xy)):
+                    logging.warning(f"Province {name} position changed, needs a restart")
+                if (any(entry.get(key) != old.get(name, {}).get(key) for key in ("adjacent", "ocean", "sea", "seas"))):
+                    topology = True
+                if (entry["level"] != old.get(name, {}).get("level")):
+                    self.refill.add(name)
+                self.game.update_province(name=name, data=entry)
+                changes.append(f"province {name} updated")
+
+        for name in self.game.provinces:
+            if (name not in seen):
+                logging.warning(f"Province {name} removed from data, needs a restart")
+
+        if (topology):
+            self.game.reset_reach()
+        if (len(added) > 0):
+            self.game.reset_stats()
+            if (self.game.atlas != None):
+                self.game.place_labels()
+        self.game.map_data = new
+        return changes
+
+    def reload(self, levels: bool = True, players: bool = True, map: bool = True) -> list[str]:
+        '''Reload data sources holding the lock, then refill only what changed, in full only if level colors or the level set changed.
+        Returns list of changes.
+        :levels: Reload level data
+        :players: Reload player data
+        :map: Reload map data'''
+        tic = time.perf_counter()
+        changes: list[str] = []
+        with self.lock:
+            # Levels first, map data refers to them and players are colored by them
+            if (levels):
+                changes += self.reload_levels()
+            if (map):
+                changes += self.reload_map()
+            if (players):
+                changes += self.reload_players()
+
+            for kind, data in self.__get_sources().items():
+                self.mtimes.update({kind: self.__get_mtime(path=data.path)})
+            provinces: list[str] = [prov for prov in self.refill if prov in self.game.provinces]
+            full: bool = self.full
+            if (self.legend):
+                self.game.map.encoded = {} # Drawn on encode
+            if (self.scheduler == None and self.game.map.has_image()):
+                if (full):
+                    self.game.update_map()
+                elif (len(provinces) > 0):
+                    self.game.update_provinces(provinces=provinces)
+            self.refill = set()
+            self.full = False
+            self.legend = False
+        if (self.scheduler != None and len(changes) > 0):
+            self.scheduler.notify(provinces=provinces, full=full)
+
+        toc = time.perf_counter()
+        logging.info(f"Reload completed, {len(changes)} changes! {toc - tic:0.4f}s")
+        return changes
+
+    def poll(self) -> list[str]:
+        '''Reload whatever changed on disk since the last reload. Returns list of changes.'''
+        changed: dict[str, bool] = {kind: self.__get_mtime(path=data.path) != self.mtimes[kind]
+                                    for kind, data in self.__get_sources().items()}
+        if (not any(changed.values())):
+            return []
+        return self.reload(levels=changed["levels"], players=changed["players"], map=changed["map"])
+
+    def watch(self, interval: float = 1.0) -> None:
+        '''Poll for changes on a background thread. Use the game from other threads holding Reloader.lock, or through the scheduler.
+        :interval: Seconds between polls'''
+        def loop() -> None:
+            while (not self.stop_event.wait(timeout=interval)):
+                try:
+                    self.poll()
+                except Exception as e:
+                    logging.error(f"*** Reload error: {str(e)}")
+
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=loop, name="reloader", daemon=True)
+        self.thread.start()
+
+    def stop(self) -> None:
+        '''Stop the background poll'''
+        self.stop_event.set()
+        if (self.thread != None):
+            self.thread.join()
+            self.thread = None
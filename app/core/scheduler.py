@@ -0,0 +1,255 @@
+# External
+import logging, threading, time
+from collections import deque
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator
+# Internal
+from app.core.game import Game
+
+
+class Ticket:
+    '''Handle for one requested render, resolved with the encoded image of the latest state'''
+    def __init__(self, priority: int, format: str, dest: Path, version: int) -> None:
+        '''Handle for one requested render, resolved with the encoded image of the latest state
+        :priority: Scheduler.interactive or Scheduler.background
+        :format: PIL image format
+        :dest: Path to also write the image to, None to only return it
+        :version: State version the image must be at least as new as'''
+        self.priority: int = priority
+        self.format: str = format
+        self.dest: Path = dest
+        self.version: int = version
+        self.requested: float = time.perf_counter()
+        self.data: bytes = None
+        self.latency: float = None # Seconds from the oldest change in the image (or the request, if nothing changed) to the image
+        self.error: Exception = None # Set if the render or writing dest failed
+        self.cancelled: bool = False
+        self.event: threading.Event = threading.Event()
+
+    @property
+    def done(self) -> bool: return self.event.is_set()
+
+    def wait(self, timeout: float = None) -> bytes:
+        '''Wait for the image. Returns encoded bytes, None if cancelled, failed (see error) or timed out.
+        :timeout: Seconds to wait, None to wait forever'''
+        self.event.wait(timeout=timeout)
+        return self.data
+
+    def cancel(self) -> None:
+        '''Drop the request, nobody will look at the image'''
+        self.cancelled = True
+        self.event.set()
+
+    def __repr__(self) -> str: return self.__str__() # Printable representation
+    def __str__(self) -> str: return f"{self.format} v{self.version} p{self.priority}" # String representation
+
+class Scheduler:
+    '''Renders a game's map on a background thread, only when someone asked for it and only at the latest state.
+    Changes are debounced, interactive requests go before background ones, and renders overtaken by a newer state are redone.'''
+    interactive: int = 0
+    background: int = 1
+
+    def __init__(self, game: Game, delay: float = 0.05, max_wait: float = 0.5) -> None:
+        '''Renders a game's map on a background thread, only when someone asked for it and only at the latest state.
+        Changes are debounced, interactive requests go before background ones, and renders overtaken by a newer state are redone.
+        :game: Game to render
+        :delay: Seconds without changes before a render starts
+        :max_wait: Most seconds a render waits for changes to settle, or is redone because of newer ones'''
+        self.game: Game = game
+        self.delay: float = delay
+        self.max_wait: float = max_wait
+
+        self.lock: threading.RLock = threading.RLock()             # Held while the game is changed or rendered
+        self.condition: threading.Condition = threading.Condition() # Guards everything below
+        self.version: int = 0            # Bumped on every change
+        self.rendered: int = 0           # Version of the working image
+        self.pending: set[str] = set()   # Provinces to refill before the next render
+        self.full: bool = False          # Full refill needed before the next render
+        self.first_change: float = None  # Oldest change not in the working image
+        self.last_change: float = None
+        self.tickets: list[Ticket] = []
+        self.latencies: deque[float] = deque(maxlen=100)
+        self.thread: threading.Thread = None
+        self.stopping: bool = False
+
+    @contextmanager
+    def changing(self, provinces: list[str] = None, full: bool = False) -> Iterator[None]:
+        '''Change the game without racing a render, then notify. Use for anything that changes ownership or fills the map.
+        :provinces: Province names to refill before the next render, None if the map is already filled
+        :full: Refill the whole map before the next render'''
+        with self.lock:
+            yield
+        self.notify(provinces=provinces, full=full)
+
+    def notify(self, provinces: list[str] = None, full: bool = False) -> None:
+        '''Mark the game as changed. Nothing is rendered until an image is requested.
+        :provinces: Province names to refill before the next render, None if the map is already filled
+        :full: Refill the whole map before the next render'''
+        now: float = time.perf_counter()
+        with self.condition:
+            self.version += 1
+            self.pending.update(provinces or [])
+            self.full = self.full or full
+            if (self.first_change == None):
+                self.first_change = now
+            self.last_change = now
+            self.condition.notify_all()
+
+    def request(self, priority: int = 0, format: str = "PNG", dest: Path = None) -> Ticket:
+        '''Ask for an image of the latest state. Returns Ticket, already resolved if the latest image is cached.
+        :priority: Scheduler.interactive or Scheduler.background
+        :format: PIL image format
+        :dest: Path to also write the image to'''
+        with self.condition:
+            ticket = Ticket(priority=priority, format=format, dest=dest, version=self.version)
+            data: bytes = self.game.map.encoded.get(format) if self.rendered == self.version else None
+            if (data == None):
+                self.tickets.append(ticket)
+                self.condition.notify_all()
+                return ticket
+
+        # Latest image is cached
+        try:
+            if (dest != None):
+                dest.write_bytes(data)
+        except OSError as e:
+            logging.error(f"*** Render write error: {str(e)}")
+            ticket.error = e
+        with self.condition:
+            self.__resolve(tickets=[ticket], data=data, changed=None)
+        return ticket
+
+    def render(self, format: str = "PNG", timeout: float = None) -> bytes:
+        '''Request an interactive image and wait for it. Returns encoded bytes, None on timeout.
+        :format: PIL image format
+        :timeout: Seconds to wait'''
+        if (self.thread == None):
+            self.start()
+        return self.request(priority=Scheduler.interactive, format=format).wait(timeout=timeout)
+
+    def __resolve(self, tickets: list[Ticket], data: bytes, changed: float) -> None:
+        '''Hand an image to tickets and record latency. Tickets with an error get no image. Called holding the condition.'''
+        now: float = time.perf_counter()
+        for ticket in tickets:
+            if (ticket.error == None):
+                ticket.data = data
+                ticket.latency = now - (changed if changed != None else ticket.requested)
+                self.latencies.append(ticket.latency)
+            ticket.event.set()
+
+    def __next(self) -> list[Ticket]:
+        '''Wait until a render is due. Returns the tickets it serves, empty when stopping. Called holding the condition.'''
+        while (not self.stopping):
+            self.tickets = [t for t in self.tickets if not t.cancelled]
+            if (len(self.tickets) == 0):
+                self.condition.wait()
+                continue
+            if (self.rendered != self.version):
+                # Debounce, but never hold a change back longer than max_wait
+                first: float = self.first_change if self.first_change != None else self.last_change
+                due: float = min(self.last_change + self.delay, first + self.max_wait)
+                wait: float = due - time.perf_counter()
+                if (wait > 0):
+                    self.condition.wait(timeout=wait)
+                    continue
+            urgent = min(self.tickets, key=lambda t: (t.priority, t.requested))
+            return [t for t in self.tickets if t.format == urgent.format]
+        return []
+
+    def run_once(self) -> bool:
+        '''Render once for the most urgent tickets. Returns False when stopping.'''
+        with self.condition:
+            tickets: list[Ticket] = self.__next()
+            if (len(tickets) == 0):
+                return False
+            version: int = self.version
+            provinces: list[str] = list(self.pending)
+            full: bool = self.full
+            changed: float = self.first_change
+            self.pending = set()
+            self.full = False
+            self.first_change = None
+
+        tic = time.perf_counter()
+        try:
+            with self.lock:
+                if (full):
+                    self.game.update_map()
+                elif (len(provinces) > 0):
+                    self.game.update_provinces(provinces=provinces)
+                data: bytes = self.game.map.get_bytes(format=tickets[0].format)
+        except Exception as e:
+            # Keep the changes for the next render, fail the tickets this one served
+            with self.condition:
+                self.pending.update(provinces)
+                self.full = self.full or full
+                if (changed != None and (self.first_change == None or changed < self.first_change)):
+                    self.first_change = changed
+                self.tickets = [t for t in self.tickets if t not in tickets]
+                for ticket in tickets:
+                    ticket.error = e
+                self.__resolve(tickets=tickets, data=None, changed=changed)
+            raise
+        toc = time.perf_counter()
+
+        with self.condition:
+            if (self.version != version and changed != None and toc - changed < self.max_wait):
+                # Superseded while rendering, redo at the newer state
+                logging.debug(f"Render of v{version} superseded by v{self.version}")
+                self.first_change = changed
+                self.rendered = version
+                return True
+            self.rendered = version
+            live: list[Ticket] = [t for t in tickets if not t.cancelled]
+            self.tickets = [t for t in self.tickets if t not in tickets]
+        logging.info(f"Rendered v{version} for {len(live)} requests in {toc - tic:0.4f}s")
+
+        try:
+            for ticket in live:
+                if (ticket.dest == None):
+                    continue
+                try:
+                    ticket.dest.write_bytes(data)
+                except OSError as e:
+                    logging.error(f"*** Render write error: {str(e)}")
+                    ticket.error = e
+        finally:
+            with self.condition:
+                self.__resolve(tickets=live, data=data, changed=changed)
+        return True
+
+    def start(self) -> None:
+        '''Start rendering on a background thread'''
+        def loop() -> None:
+            while (True):
+                try:
+                    if (not self.run_once()):
+                        return
+                except Exception as e:
+                    logging.error(f"*** Render error: {str(e)}")
+
+        with self.condition:
+            self.stopping = False
+        self.thread = threading.Thread(target=loop, name="scheduler", daemon=True)
+        self.thread.start()
+
+    def stop(self) -> None:
+        '''Stop the background thread. Waiting tickets are cancelled.'''
+        with self.condition:
+            self.stopping = True
+            for ticket in self.tickets:
+                ticket.cancel()
+            self.tickets = []
+            self.condition.notify_all()
+        if (self.thread != None):
+            self.thread.join()
+            self.thread = None
+
+    def get_latency(self) -> dict[str, float]:
+        '''Get change-to-image latency of recent renders. Returns dict with count, last, mean and max seconds.'''
+        with self.condition:
+            values: list[float] = list(self.latencies)
+        if (len(values) == 0):
+            return {"count": 0, "last": 0.0, "mean": 0.0, "max": 0.0}
+        return {"count": len(values), "last": values[-1], "mean": sum(values) / len(values), "max": max(values)}
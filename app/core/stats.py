@@ -0,0 +1,121 @@
+# External
+import logging, time
+# Internal
+from app.core.province import Province, Region
+from app.core.level import LevelBase
+from app.core.player import Player
+
+
+class Stats:
+    '''Per-player and per-region aggregates, kept up to date on every owner or level change'''
+    def __init__(self, regions: dict[str, Region]) -> None:
+        '''Per-player and per-region aggregates, kept up to date on every owner or level change
+        :regions: dict of all regions, with their provinces'''
+        self.regions: dict[str, Region] = regions
+        self.region_of: dict[str, str] = {prov: reg for reg, region in regions.items() for prov in region.provinces}
+        self.region_sizes: dict[str, int] = {reg: len(region.provinces) for reg, region in regions.items()}
+
+        self.totals: dict[Player, int] = {}                      # Player -> provinces owned
+        self.levels: dict[Player, dict[str, int]] = {}           # Player -> level name -> provinces owned
+        self.production: dict[Player, int] = {}                  # Player -> sum of level products
+        self.region_counts: dict[str, dict[Player, int]] = {}    # Region -> player -> provinces owned
+        self.rebuild()
+
+    def rebuild(self) -> None:
+        '''Recount everything from scratch, e.g. after level products change'''
+        tic = time.perf_counter()
+        self.totals = {}
+        self.levels = {}
+        self.production = {}
+        self.region_counts = {reg: {} for reg in self.regions}
+        for region in self.regions.values():
+            for province in region.provinces.values():
+                self.__add(province=province, owner=province.owner, level=province.level, sign=1)
+        toc = time.perf_counter()
+        logging.info(f"Stats completed! {toc - tic:0.4f}s")
+
+    def watch(self, province: Province) -> None:
+        '''Start following changes to a province
+        :province: Province object'''
+        if (self.on_change not in province.listeners):
+            province.listeners.append(self.on_change)
+
+    def unwatch(self, province: Province) -> None:
+        '''Stop following changes to a province
+        :province: Province object'''
+        if (self.on_change in province.listeners):
+            province.listeners.remove(self.on_change)
+
+    def __add(self, province: Province, owner: Player, level: LevelBase, sign: int) -> None:
+        '''Add (sign 1) or remove (sign -1) one province's contribution'''
+        if (owner == None):
+            return
+        self.totals[owner] = self.totals.get(owner, 0) + sign
+        levels = self.levels.setdefault(owner, {})
+        levels[level.name] = levels.get(level.name, 0) + sign
+        if (levels[level.name] == 0):
+            levels.pop(level.name)
+        self.production[owner] = self.production.get(owner, 0) + sign * level.product
+
+        reg: str = self.region_of.get(province.name)
+        if (reg != None):
+            counts = self.region_counts[reg]
+            counts[owner] = counts.get(owner, 0) + sign
+            if (counts[owner] == 0):
+                counts.pop(owner)
+
+    def on_change(self, province: Province, old_owner: Player, old_level: LevelBase) -> None:
+        '''Province listener, moves the province's contribution from its old owner/level to the new one'''
+        self.__add(province=province, owner=old_owner, level=old_level, sign=-1)
+        self.__add(province=province, owner=province.owner, level=province.level, sign=1)
+
+    def get_count(self, player: Player, level: str = None) -> int:
+        '''Get how many provinces a player owns
+        :player: Player object
+        :level: Only count provinces of this level name'''
+        if (level == None):
+            return self.totals.get(player, 0)
+        return self.levels.get(player, {}).get(level, 0)
+
+    def get_production(self, player: Player) -> int:
+        '''Get the summed product of a player's provinces
+        :player: Player object'''
+        return self.production.get(player, 0)
+
+    def get_completion(self, region: str, player: Player) -> float:
+        '''Get the share of a region a player owns, 0.0 - 1.0
+        :region: Region name
+        :player: Player object'''
+        if (self.region_sizes[region] == 0):
+            return 0.0
+        return self.region_counts[region].get(player, 0) / self.region_sizes[region]
+
+    def get_missing(self, region: str, player: Player) -> int:
+        '''Get how many provinces a player still needs to complete a region
+        :region: Region name
+        :player: Player object'''
+        return self.region_sizes[region] - self.region_counts[region].get(player, 0)
+
+    def get_controller(self, region: str) -> Player:
+        '''Get the player who owns all of a region. Returns Player object, None if nobody does.
+        :region: Region name'''
+        counts = self.region_counts[region]
+        if (len(counts) == 1):
+            player, count = next(iter(counts.items()))
+            if (count == self.region_sizes[region]):
+                return player
+        return None
+
+    def get_regions(self, player: Player) -> list[str]:
+        '''Get regions a player controls completely. Returns list of region names.
+        :player: Player object'''
+        return [reg for reg in self.regions if self.get_controller(region=reg) == player]
+
+    def get_leaderboard(self, by: str = "provinces") -> list[tuple[Player, int]]:
+        '''Get players ranked, highest first. Returns list of (Player, value).
+        :by: "provinces" or "production"'''
+        values: dict[Player, int] = self.production if by == "production" else self.totals
+        return sorted(values.items(), key=lambda item: item[1], reverse=True)
+
+    def __repr__(self) -> str: return self.__str__() # Printable representation
+    def __str__(self) -> str: return str({player.name: self.totals[player] for player in self.totals}) # String representation
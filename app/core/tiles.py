@@ -0,0 +1,112 @@
+# External
+import io, logging, os, struct, time, zlib
+import numpy as np
+from PIL import Image
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable
+
+
+class Tiles:
+    '''Splits work on a map into horizontal tiles run on a thread pool. NumPy fills and zlib compression release the GIL.'''
+    def __init__(self, workers: int = None, rows: int = 256, level: int = 6) -> None:
+        '''Splits work on a map into horizontal tiles run on a thread pool. NumPy fills and zlib compression release the GIL.
+        :workers: Threads, None for one per core
+        :rows: Rows per tile
+        :level: zlib compression level for PNG'''
+        self.workers: int = workers if workers != None else (os.cpu_count() or 1)
+        self.rows: int = rows
+        self.level: int = level
+        self.pool: ThreadPoolExecutor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="tiles")
+
+    def split(self, height: int) -> list[tuple[int, int]]:
+        '''Get tile row ranges. Returns list of (y0, y1).
+        :height: Image height'''
+        rows: int = max(self.rows, -(-height // (self.workers * 4))) # At least a few tiles per worker, no more
+        return [(y0, min(y0 + rows, height)) for y0 in range(0, height, rows)]
+
+    def run(self, func: Callable[[int, int], object], height: int) -> list:
+        '''Run func(y0, y1) for every tile. Returns results in tile order.
+        :func: Function of a tile's row range
+        :height: Image height'''
+        return list(self.pool.map(lambda rng: func(*rng), self.split(height=height)))
+
+    @staticmethod
+    def __chunk(kind: bytes, data: bytes) -> bytes:
+        '''Build a PNG chunk'''
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+    @staticmethod
+    def __adler32_combine(adler1: int, adler2: int, len2: int) -> int:
+        '''Combine adler32 checksums of two blocks, as zlib's adler32_combine'''
+        base: int = 65521
+        rem: int = len2 % base
+        sum1: int = adler1 & 0xffff
+        sum2: int = (rem * sum1) % base
+        sum1 += (adler2 & 0xffff) + base - 1
+        sum2 += ((adler1 >> 16) & 0xffff) + ((adler2 >> 16) & 0xffff) + base - rem
+        sum1 %= base
+        sum2 %= base
+        return (sum2 << 16) | sum1
+
+    def encode_png(self, array: np.ndarray, palette: np.ndarray = None) -> bytes:
+        '''Encode an image as one PNG stream, filtering and deflating tiles in parallel. Returns encoded bytes.
+        Every tile is raw deflate ending on a sync flush, the last one finished, so the tiles concatenate into one zlib stream.
+        :array: (h, w, 3) uint8 RGB, or (h, w) uint8 palette indices
+        :palette: (n, 3) uint8 palette for palette indices'''
+        tic = time.perf_counter()
+        height, width = array.shape[:2]
+        ranges = self.split(height=height)
+        bpp: int = 1 if array.ndim == 2 else 3
+        flat = array.reshape(height, width * bpp)
+
+        def compress(i: int) -> tuple[bytes, int, int]:
+            y0, y1 = ranges[i]
+            rows = flat[y0:y1]
+            out = np.empty((y1 - y0, width * bpp + 1), dtype=np.uint8)
+            if (palette is not None):
+                # Palette images compress best unfiltered
+                out[:, 0] = 0
+                out[:, 1:] = rows
+            else:
+                # Sub filter, difference to the pixel on the left
+                out[:, 0] = 1
+                out[:, 1:bpp + 1] = rows[:, :bpp]
+                np.subtract(rows[:, bpp:], rows[:, :-bpp], out=out[:, bpp + 1:])
+            raw: bytes = out.tobytes()
+            compressor = zlib.compressobj(self.level, zlib.DEFLATED, -15)
+            last: bool = i == len(ranges) - 1
+            data: bytes = compressor.compress(raw) + compressor.flush(zlib.Z_FINISH if last else zlib.Z_SYNC_FLUSH)
+            return data, zlib.adler32(raw), len(raw)
+
+        parts = list(self.pool.map(compress, range(len(ranges))))
+        adler: int = 1
+        for _, part_adler, length in parts:
+            adler = Tiles.__adler32_combine(adler1=adler, adler2=part_adler, len2=length)
+        stream: bytes = b"\x78\x9c" + b"".join(data for data, _, _ in parts) + struct.pack(">I", adler)
+
+        color_type: int = 2 if palette is None else 3
+        png: list[bytes] = [b"\x89PNG\r\n\x1a\n",
+                            Tiles.__chunk(kind=b"IHDR", data=struct.pack(">IIBBBBB", width, height, 8, color_type, 0, 0, 0))]
+        if (palette is not None):
+            png.append(Tiles.__chunk(kind=b"PLTE", data=np.asarray(palette, dtype=np.uint8).tobytes()))
+        png.append(Tiles.__chunk(kind=b"IDAT", data=stream))
+        png.append(Tiles.__chunk(kind=b"IEND", data=b""))
+        toc = time.perf_counter()
+        logging.debug(f"Encoded PNG in {len(ranges)} tiles {toc - tic:0.4f}s")
+        return b"".join(png)
+
+    def encode_tiles(self, image: Image.Image, format: str = "WEBP", **params) -> list[tuple[int, bytes]]:
+        '''Encode each tile as its own image, in parallel, e.g. for formats whose streams can't be joined like WebP.
+        Returns list of (y0, encoded bytes), to be stacked top to bottom by the viewer.
+        :image: PIL image
+        :format: PIL image format
+        :params: Encoder options, e.g. lossless=True'''
+        def encode(y0: int, y1: int) -> tuple[int, bytes]:
+            buffer = io.BytesIO()
+            image.crop((0, y0, image.width, y1)).save(buffer, format=format, **params)
+            return y0, buffer.getvalue()
+        return self.run(func=encode, height=image.height)
+
+    def close(self) -> None:
+        '''Stop the thread pool'''
+        self.pool.shutdown()
@@ -0,0 +1,139 @@
+# External
+import logging, time
+from typing import TYPE_CHECKING
+# Internal
+from app.core.province import Province
+from app.core.player import Player
+from app.core.claim import Claim
+if TYPE_CHECKING:
+    from app.core.game import Game
+
+
+class ClaimResult:
+    '''Container class for the outcome of one claim in a transaction'''
+    def __init__(self, player: Player, province: Province, code: int, cost: int) -> None:
+        '''Container class for the outcome of one claim in a transaction
+        :player: Player object making the claim
+        :province: Province object being claimed
+        :code: Claim status code, see Claim
+        :cost: Cost charged, 0 if the claim is not ok'''
+        self.player: Player = player
+        self.province: Province = province
+        self.code: int = code
+        self.cost: int = cost
+
+    @property
+    def ok(self) -> bool: return self.code == Claim.ok.value
+
+    def __repr__(self) -> str: return self.__str__() # Printable representation
+    def __str__(self) -> str: return f"{self.player.name} -> {self.province.name}: {Claim.check(code=self.code)} ({self.cost})" # String representation
+
+class Transaction:
+    '''Batch of claims that are validated together, applied at once, then rendered and saved once'''
+    def __init__(self, game: "Game", atomic: bool = True, charge: bool = False) -> None:
+        '''Batch of claims that are validated together, applied at once, then rendered and saved once
+        :game: Game to apply the claims to
+        :atomic: If True, one invalid claim rejects the whole batch. If False, only the valid claims are applied.
+        :charge: If True, claims are checked against and paid from the player balance. Off by default, nothing credits balances yet.'''
+        self.game: "Game" = game
+        self.atomic: bool = atomic
+        self.charge: bool = charge
+        self.claims: list[tuple[Player, Province]] = []
+        self.results: list[ClaimResult] = []
+
+    def add(self, player: Player, province: Province) -> None:
+        '''Queue a claim. Claims are resolved in the order they are added.
+        :player: Player object making the claim
+        :province: Province object being claimed'''
+        self.claims.append((player, province))
+
+    def validate(self) -> list[ClaimResult]:
+        '''Resolve the queued claims against the current state, without applying them. Returns one result per claim.
+        Earlier claims in the batch count towards the ownership, adjacency and balance seen by later ones.'''
+        owners: dict[str, Player] = {}              # Claims won so far in this batch
+        balances: dict[Player, int] = {}
+        frontier: dict[Player, tuple[set, set]] = {} # Player -> (direct adjacents, all adjacents)
+        results: list[ClaimResult] = []
+
+        for player, province in self.claims:
+            if (player not in frontier):
+                frontier.update({player: self.game.get_frontier(owned=self.game.get_owned(player=player))})
+                balances.update({player: player.balance})
+            direct, reachable = frontier[player]
+
+            owner: Player = owners.get(province.name, province.owner)
+            stats: list = []
+            cost: int = 0
+            if (owner == player):
+                stats.append(Claim.self_owned)
+            elif (owner != None):
+                stats.append(Claim.other_owned)
+            elif (province.name not in reachable):
+                stats.append(Claim.not_adjacent)
+            else:
+                cost = self.game.get_claim_cost(province=province, direct=province.name in direct)
+                if (self.charge and cost > balances[player]):
+                    stats.append(Claim.no_funds)
+                else:
+                    stats.append(Claim.ok)
+
+            code: int = Claim.get(status_list=stats)
+            if (code != Claim.ok.value):
+                results.append(ClaimResult(player=player, province=province, code=code, cost=0))
+                continue
+
+            # Claim wins, later claims see the new state
+            results.append(ClaimResult(player=player, province=province, code=code, cost=cost))
+            owners.update({province.name: player})
+            if (self.charge):
+                balances[player] -= cost
+            new_direct, new_reachable = self.game.get_frontier(owned=[province.name])
+            direct.update(new_direct)
+            reachable.update(new_reachable)
+
+        return results
+
+    def commit(self) -> list[ClaimResult]:
+        '''Validate and apply the queued claims as the next turn, then render and save once. Returns one result per claim.
+        If anything fails while applying, every change and the turn are rolled back and the error is raised.'''
+        tic = time.perf_counter()
+        self.results = self.validate()
+        accepted: list[ClaimResult] = [r for r in self.results if r.ok]
+
+        if (self.atomic and len(accepted) != len(self.results)):
+            logging.info(f"Transaction rejected, {len(self.results) - len(accepted)} of {len(self.results)} claims invalid")
+            return self.results
+        if (len(accepted) == 0):
+            return self.results
+
+        # Snapshot for rollback
+        owners: dict[Province, Player] = {r.province: r.province.owner for r in accepted}
+        balances: dict[Player, int] = {r.player: r.player.balance for r in accepted}
+        changed: list[str] = [r.province.name for r in accepted]
+        turn: int = self.game.turn
+
+        try:
+            self.game.next_turn()
+            for result in accepted:
+                result.province.update_owner(owner=result.player)
+                if (self.charge):
+                    result.player.balance -= result.cost
+            self.game.update_provinces(provinces=changed)
+            keys: dict[Player, str] = {player: key for key, player in self.game.players.items()}
+            if (not self.game.save_players(history=[(keys[r.player], r.province.name, r.cost) for r in accepted])):
+                raise IOError(f"Could not save player data to {self.game.player_data.path.__str__()}")
+        except Exception as e:
+            logging.error(f"*** Transaction failed, rolling back: {str(e)}")
+            for province, owner in owners.items():
+                province.update_owner(owner=owner)
+            for player, balance in balances.items():
+                player.balance = balance
+            self.game.turn = turn
+            self.game.update_provinces(provinces=changed)
+            if (not self.game.save_players()):
+                logging.error("*** Could not save player data after rolling back, disk may still hold the failed claims")
+            raise
+
+        toc = time.perf_counter()
+        logging.info(f"Transaction of {len(accepted)} claims completed! {toc - tic:0.4f}s")
+        return self.results
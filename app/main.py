@@ -7,6 +7,8 @@ from pathlib import Path
 from app.core.data import Data
 from app.core.map import Map
 from app.core.game import Game
+from app.core.atlas import Atlas
+from app.core.tiles import Tiles
 
 
 class Main:
@@ -21,6 +23,9 @@ class Main:
         self.LEVELFILE: str = ""
         self.LOGLEVEL: str = ""
         self.FONT: str = ""
+        self.INDEXED: bool = False
+        self.LABELS: bool = False
+        self.WORKERS: int = 1
         
         # Load environment vars, logging
         self.__load_env()
@@ -38,18 +43,39 @@ class Main:
         self.level_data: Data = Data(file=self.levelfile_path, source=Data.Source.json)
         self.mask_data: Data = Data(file=self.maskfile_path, source=Data.Source.npz)
         self.map_data: Data = Data(file=self.datafile_path, source=Data.Source.json)
-        self.player_data: Data = Data(file=self.playerfile_path, source=Data.Source.json)
-        self.map: Map = Map(font=self.font_path, in_image=self.imagefile_path)
+        self.player_data: Data = self.__load_players()
+        self.tiles: Tiles = Tiles(workers=self.WORKERS or None) if self.WORKERS != 1 else None
+        self.map: Map = Map(font=self.font_path, in_image=self.imagefile_path, indexed=self.INDEXED, tiles=self.tiles)
 
         # Setup game
         self.game = Game(leveld=self.level_data,
                          maskd=self.mask_data,
                          mapd=self.map_data,
                          playerd=self.player_data,
-                         map=self.map)
+                         map=self.map,
+                         atlas=Atlas(font=self.font_path) if self.LABELS else None)
         
-        # Start
-        self.game.start()
+        # Start, then shut down even if it failed
+        try:
+            self.game.start()
+        finally:
+            self.close()
+
+    def close(self) -> None:
+        '''Stop the tile worker threads and close player data'''
+        if (self.tiles != None):
+            self.tiles.close()
+        self.game.player_data.close()
+
+    def __load_players(self) -> Data:
+        '''Load player data, from sqlite if PLAYERFILE ends in .db. A missing database is imported from the json file next to it.'''
+        if (self.playerfile_path.suffix != Data.Source.sqlite.ext):
+            return Data(file=self.playerfile_path, source=Data.Source.json)
+        json_path: Path = self.playerfile_path.with_suffix(Data.Source.json.ext)
+        if (not self.playerfile_path.exists() and json_path.exists()):
+            logging.info(f"Importing {json_path.__str__()} into {self.playerfile_path.__str__()}")
+            return Data.import_json(json_file=json_path, db_file=self.playerfile_path)
+        return Data(file=self.playerfile_path, source=Data.Source.sqlite)
 
     def __load_env(self) -> None:
         '''Loads from .env using dotenv'''
@@ -61,6 +87,9 @@ class Main:
         self.LEVELFILE = os.getenv("LEVELFILE", default="app/sample_data/levels.json")
         self.FONT = os.getenv("FONT", default="app/sample_data/unispace.ttf")
         self.LOGLEVEL = os.getenv("LOGLEVEL", default="error")
+        self.INDEXED = os.getenv("INDEXED", default="false").lower() in ("1", "true", "yes")
+        self.LABELS = os.getenv("LABELS", default="false").lower() in ("1", "true", "yes")
+        self.WORKERS = int(os.getenv("WORKERS", default="1"))
 
     def __set_logging(self) -> None:
         '''Sets logging options'''
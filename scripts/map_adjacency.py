@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+'''Derive province adjacency from the map image and diff it against the map data.
+
+Provinces are labelled from their "pos" seed points, then every pair of labels
+that touch across at most --border pixels of border is adjacent.
+
+Run from the repository root, e.g.:
+    python3 -m scripts.map_adjacency
+    python3 -m scripts.map_adjacency --border 3 --write merge
+'''
+# External
+import argparse, logging
+import numpy as np
+from PIL import Image
+from pathlib import Path
+# Internal
+from app.core.data import Data
+from app.core.labelmap import LabelMap
+
+
+def get_diff(current: dict[str, list[str]], derived: dict[str, list[str]]) -> dict[str, dict[str, list[str]]]:
+    '''Compare adjacency lists. Returns dict of province name -> {"added": [...], "removed": [...]} for changed provinces.
+    :current: Adjacency from the map data
+    :derived: Adjacency derived from the image'''
+    diff: dict[str, dict[str, list[str]]] = {}
+    for prov in current:
+        old, new = set(current[prov]), set(derived.get(prov, []))
+        if (old != new):
+            diff.update({prov: {"added": sorted(new - old), "removed": sorted(old - new)}})
+    return diff
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Derive province adjacency from the map image.")
+    parser.add_argument("--data", type=Path, default=Path("app/sample_data/image.json"), help="Map data file")
+    parser.add_argument("--image", type=Path, default=Path("app/sample_data/image.png"), help="Base map image")
+    parser.add_argument("--border", type=int, default=2, help="Widest border in pixels between adjacent provinces")
+    parser.add_argument("--write", choices=["merge", "replace"], default=None,
+                        help="Update the map data: 'merge' only adds links, 'replace' also drops links not found on the image")
+    parser.add_argument("--loglevel", default="info", help="Logging level")
+    args = parser.parse_args()
+
+    logging.basicConfig(format="[%(asctime)s.%(msecs)03d][%(levelname)s][%(filename)s:%(lineno)s] %(message)s",
+                        datefmt="%Y-%m-%d %H:%M:%S", level=args.loglevel.upper())
+
+    map_data: Data = Data(file=args.data.resolve(), source=Data.Source.json)
+    image: np.ndarray = np.array(object=Image.open(fp=args.image.resolve(), mode="r").convert("RGB"))
+
+    seeds: dict[str, tuple] = {}
+    current: dict[str, list[str]] = {}
+    for reg in map_data.data:
+        for prov, province in map_data.data[reg].items():
+            x, y = province["pos"]
+            seeds.update({prov: (x, y)})
+            current.update({prov: province["adjacent"]})
+
+    labels: LabelMap = LabelMap.from_seeds(image=image, seeds=seeds)
+    derived: dict[str, list[str]] = labels.get_adjacency(border=args.border)
+    diff = get_diff(current=current, derived=derived)
+
+    for prov, change in diff.items():
+        changes = [f"+{p}" for p in change["added"]] + [f"-{p}" for p in change["removed"]]
+        print(f"{prov}: {' '.join(changes)}")
+    print(f"{len(diff)} of {len(current)} provinces differ")
+
+    if (args.write != None and len(diff) > 0):
+        for reg in map_data.data:
+            for prov, province in map_data.data[reg].items():
+                if (args.write == "merge"):
+                    province["adjacent"] = province["adjacent"] + [p for p in derived[prov] if p not in province["adjacent"]]
+                else:
+                    # Keep links to provinces that are not in the data yet, they cannot be checked
+                    unknown = [p for p in province["adjacent"] if p not in seeds]
+                    province["adjacent"] = derived[prov] + unknown
+        map_data.write_data()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,332 @@
+#!/usr/bin/env python3
+'''Generate synthetic maps and rosters for scale testing.
+
+Writes a base image, map data (same region -> province schema as image.json),
+levels and players into an output directory. Provinces are cells of a Voronoi
+partition of the image; cells along the image edge become ocean and a few
+interior cells become named seas.
+
+Run from the repository root, e.g.:
+    python3 -m scripts.map_generator --scale 10 --players 40 --out /tmp/map10x
+'''
+# External
+import argparse, json, logging, time
+import numpy as np
+from PIL import Image
+from scipy.spatial import cKDTree
+from scipy.ndimage import binary_dilation
+from pathlib import Path
+
+
+# Size of app/sample_data, used as the 1x reference for --scale
+BASE_WIDTH: int = 5632
+BASE_HEIGHT: int = 2106
+BASE_PROVINCES: int = 242
+
+WATER: tuple = (229, 229, 229)
+BORDER: tuple = (102, 102, 102)
+
+
+class Generator:
+    '''Synthetic map, level and player generator'''
+    def __init__(self, width: int, height: int, provinces: int, regions: int, levels: int,
+                 seas: int, border: int = 1, seed: int = None) -> None:
+        '''Synthetic map, level and player generator
+        :width: Image width in pixels
+        :height: Image height in pixels
+        :provinces: Number of land provinces
+        :regions: Number of regions to group provinces into
+        :levels: Number of province levels
+        :seas: Number of inland sea cells
+        :border: Border width in pixels
+        :seed: Seed for the random generator, for reproducible datasets'''
+        self.width: int = width
+        self.height: int = height
+        self.n_provinces: int = provinces
+        self.n_regions: int = max(1, min(regions, provinces))
+        self.n_levels: int = levels
+        self.n_seas: int = seas
+        self.border: int = border
+        self.rng: np.random.Generator = np.random.default_rng(seed=seed)
+
+        self.sites: np.ndarray = None   # (n, 2) float array of cell sites, x/y
+        self.water: np.ndarray = None   # (n,) bool, cell is water
+        self.sea: np.ndarray = None     # (n,) int, sea index for sea cells, -1 otherwise
+        self.labels: np.ndarray = None  # (h, w) int32, cell index per pixel
+        self.borders: np.ndarray = None # (h, w) bool, border pixels
+        self.names: list[str] = []      # province names, by cell index (water cells get None)
+        self.levels: dict = {}
+        self.map_data: dict = {}
+
+    @staticmethod
+    def get_name(index: int, length: int = 3) -> str:
+        '''Build a province abbreviation from an index: AAA, AAB, ...
+        :index: Index to encode
+        :length: Minimum name length'''
+        name: str = ""
+        while (index > 0 or len(name) < length):
+            name = chr(ord("A") + index % 26) + name
+            index //= 26
+        return name
+
+    def __make_sites(self) -> None:
+        '''Place cell sites. A ring of ocean cells is laid along the edges, land cells are spread inside.'''
+        margin_x: float = self.width * 0.04
+        margin_y: float = self.height * 0.06
+
+        land = np.column_stack((self.rng.uniform(margin_x, self.width - margin_x, self.n_provinces + self.n_seas),
+                                self.rng.uniform(margin_y, self.height - margin_y, self.n_provinces + self.n_seas)))
+
+        # Ocean ring, spaced to roughly match land cell size
+        spacing: float = np.sqrt((self.width * self.height) / max(1, self.n_provinces))
+        xs = np.arange(0, self.width, spacing)
+        ys = np.arange(0, self.height, spacing)
+        ocean = np.concatenate((np.column_stack((xs, np.zeros_like(xs))),
+                                np.column_stack((xs, np.full_like(xs, self.height - 1))),
+                                np.column_stack((np.zeros_like(ys), ys)),
+                                np.column_stack((np.full_like(ys, self.width - 1), ys))))
+
+        self.sites = np.concatenate((land, ocean))
+        self.water = np.zeros(len(self.sites), dtype=bool)
+        self.water[len(land):] = True
+        self.sea = np.full(len(self.sites), -1, dtype=np.int32)
+
+        # Interior seas
+        sea_cells = self.rng.choice(len(land), size=self.n_seas, replace=False)
+        self.water[sea_cells] = True
+        self.sea[sea_cells] = np.arange(self.n_seas)
+
+    def __make_labels(self, chunk: int = 256) -> None:
+        '''Rasterize the Voronoi partition, in row chunks to bound memory
+        :chunk: Number of rows to query at once'''
+        tree = cKDTree(self.sites)
+        self.labels = np.empty((self.height, self.width), dtype=np.int32)
+        xs = np.arange(self.width)
+
+        for y0 in range(0, self.height, chunk):
+            y1 = min(y0 + chunk, self.height)
+            gx, gy = np.meshgrid(xs, np.arange(y0, y1))
+            _, idx = tree.query(np.column_stack((gx.ravel(), gy.ravel())), workers=-1)
+            self.labels[y0:y1] = idx.reshape(y1 - y0, self.width)
+
+        # Border wherever a pixel differs from its right or lower neighbor
+        edges = np.zeros_like(self.labels, dtype=bool)
+        edges[:, :-1] |= self.labels[:, :-1] != self.labels[:, 1:]
+        edges[:-1, :] |= self.labels[:-1, :] != self.labels[1:, :]
+        # No borders between two water cells
+        water = self.water[self.labels]
+        edges[:, :-1] &= ~(water[:, :-1] & water[:, 1:])
+        edges[:-1, :] &= ~(water[:-1, :] & water[1:, :])
+        if (self.border > 1):
+            edges = binary_dilation(input=edges, iterations=self.border - 1)
+        self.borders = edges
+
+    def __get_pairs(self) -> np.ndarray:
+        '''Get unique (a, b) index pairs of touching cells, a < b'''
+        pairs = np.concatenate((np.column_stack((self.labels[:, :-1].ravel(), self.labels[:, 1:].ravel())),
+                                np.column_stack((self.labels[:-1, :].ravel(), self.labels[1:, :].ravel()))))
+        pairs = pairs[pairs[:, 0] != pairs[:, 1]]
+        pairs.sort(axis=1)
+        return np.unique(pairs, axis=0)
+
+    def __get_pos(self, index: int) -> tuple:
+        '''Get a seed position for a cell that is not on a border. Returns None if the whole cell is border, e.g. a tiny cell eaten by dilation.
+        :index: Cell index'''
+        x, y = int(self.sites[index][0]), int(self.sites[index][1])
+        if (self.labels[y, x] == index and not self.borders[y, x]):
+            return (x, y)
+
+        # Site landed on a border, take the nearest interior pixel of the cell
+        r: int = 8
+        while True:
+            y0, y1 = max(0, y - r), min(self.height, y + r)
+            x0, x1 = max(0, x - r), min(self.width, x + r)
+            inside = np.argwhere((self.labels[y0:y1, x0:x1] == index) & ~self.borders[y0:y1, x0:x1])
+            if (len(inside) > 0):
+                dy, dx = inside[np.argmin(np.abs(inside - (y - y0, x - x0)).sum(axis=1))]
+                return (int(x0 + dx), int(y0 + dy))
+            if (y0 == 0 and x0 == 0 and y1 == self.height and x1 == self.width):
+                return None
+            r *= 2
+
+    def __make_levels(self) -> None:
+        '''Generate levels with green shades, lighter for cheaper levels'''
+        for i in range(self.n_levels):
+            green: int = int(178 - (102 * i / max(1, self.n_levels - 1)))
+            name: str = f"level{i + 1}"
+            self.levels.update({name: {"name": name,
+                                       "cost": 5 * (i + 1),
+                                       "product": 2 * i + 1,
+                                       "color": [0, green, 0]}})
+
+    def __make_mapdata(self) -> None:
+        '''Build region -> province map data'''
+        land = np.flatnonzero(~self.water)
+        pos: dict[int, tuple] = {int(cell): self.__get_pos(index=cell) for cell in land}
+        dropped: set[int] = {cell for cell in pos if pos[cell] == None}
+        if (len(dropped) > 0):
+            # Drawn as border anyway, leave them out
+            logging.warning(f"Dropping {len(dropped)} cells with no pixels off the borders")
+            land = np.array([cell for cell in land if pos[int(cell)] != None], dtype=land.dtype)
+        self.names = [None] * len(self.sites)
+        for i, cell in enumerate(land):
+            self.names[cell] = Generator.get_name(index=i)
+
+        # Group provinces into regions around random centers
+        centers = self.rng.choice(land, size=self.n_regions, replace=False)
+        _, region_of = cKDTree(self.sites[centers]).query(self.sites[land])
+
+        # Adjacency between land cells, ocean and sea access
+        adjacent: dict[int, list[int]] = {int(cell): [] for cell in land}
+        ocean: set[int] = set()
+        seas: dict[int, list[int]] = {int(cell): [] for cell in land}
+        for a, b in self.__get_pairs():
+            a, b = int(a), int(b)
+            if (a in dropped or b in dropped):
+                continue
+            if (not self.water[a] and not self.water[b]):
+                adjacent[a].append(b)
+                adjacent[b].append(a)
+            elif (self.water[a] != self.water[b]):
+                land_cell, water_cell = (b, a) if self.water[a] else (a, b)
+                if (self.sea[water_cell] >= 0):
+                    seas[land_cell].append(int(self.sea[water_cell]))
+                else:
+                    ocean.add(land_cell)
+
+        level_names: list[str] = list(self.levels)
+        level_of = self.rng.integers(0, len(level_names), size=len(land))
+
+        for i, cell in enumerate(land):
+            cell = int(cell)
+            region: str = f"R{region_of[i] + 1}"
+            if (region not in self.map_data):
+                self.map_data.update({region: {}})
+            self.map_data[region].update({self.names[cell]: {
+                "pos": list(pos[cell]),
+                "level": level_names[level_of[i]],
+                "sea": len(seas[cell]) > 0,
+                "seas": [f"sea{s + 1}" for s in sorted(set(seas[cell]))],
+                "ocean": cell in ocean,
+                "adjacent": [self.names[adj] for adj in adjacent[cell]]}})
+
+    def get_players(self, players: int, owned: float) -> dict:
+        '''Generate players with random, non-overlapping holdings
+        :players: Number of players
+        :owned: Fraction of all provinces to hand out, 0.0 - 1.0'''
+        roster: dict = {}
+        regions: list[str] = list(self.map_data)
+        self.rng.shuffle(regions)
+
+        provinces: list[str] = [prov for reg in regions for prov in self.map_data[reg]]
+        budget: int = int(len(provinces) * owned)
+
+        # Whole regions first, then loose provinces from the remaining regions
+        holdings: list[dict] = [{"regions": [], "provinces": []} for _ in range(players)]
+        given: int = 0
+        turn: int = 0
+        remaining: list[str] = []
+        for reg in regions:
+            size: int = len(self.map_data[reg])
+            if (players > 0 and given + size <= budget // 2):
+                holdings[turn % players]["regions"].append(reg)
+                given += size
+                turn += 1
+            else:
+                remaining += list(self.map_data[reg])
+
+        self.rng.shuffle(remaining)
+        for prov in remaining[:max(0, budget - given)]:
+            if (players == 0):
+                break
+            holdings[turn % players]["provinces"].append(prov)
+            turn += 1
+
+        for i in range(players):
+            name: str = f"Player{i + 1}"
+            r, g, b = (int(c) for c in self.rng.integers(64, 256, size=3))
+            roster.update({name: {"name": name,
+                                  "snowflake": int(self.rng.integers(10**17, 10**18)),
+                                  "color": None,
+                                  "custom_color": [r, g, b],
+                                  "owned": holdings[i]}})
+        return roster
+
+    def get_image(self) -> Image.Image:
+        '''Render the base image from the partition'''
+        palette = np.empty((len(self.sites), 3), dtype=np.uint8)
+        palette[self.water] = WATER
+        for region in self.map_data.values():
+            for prov in region.values():
+                x, y = prov["pos"]
+                palette[self.labels[y, x]] = self.levels[prov["level"]]["color"]
+
+        image = palette[self.labels]
+        image[self.borders] = BORDER
+        return Image.fromarray(obj=image, mode="RGB")
+
+    def generate(self) -> None:
+        '''Generate the partition, levels and map data'''
+        tic = time.perf_counter()
+        logging.info(f"Generating {self.n_provinces} provinces on a {self.width}x{self.height} map...")
+        self.__make_sites()
+        self.__make_labels()
+        self.__make_levels()
+        self.__make_mapdata()
+        toc = time.perf_counter()
+        logging.info(f"Generating completed! {toc - tic:0.4f}s")
+
+    def write(self, dest: Path, players: int, owned: float) -> None:
+        '''Write image.png, image.json, levels.json and players.json into a directory
+        :dest: Output directory
+        :players: Number of players
+        :owned: Fraction of all provinces owned by players'''
+        dest.mkdir(parents=True, exist_ok=True)
+        files: dict[str, dict] = {"image.json": self.map_data,
+                                  "levels.json": self.levels,
+                                  "players.json": self.get_players(players=players, owned=owned)}
+        for name, data in files.items():
+            logging.info(f"Writing data to file: {(dest / name).__str__()}")
+            with open(file=(dest / name).__str__(), mode="w", encoding="utf-8") as f:
+                json.dump(data, f, ensure_ascii=False, indent=2)
+
+        logging.info(f"Writing map to {(dest / 'image.png').__str__()}")
+        self.get_image().save((dest / "image.png").__str__())
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Generate a synthetic o9-province dataset for scale testing.")
+    parser.add_argument("--out", type=Path, required=True, help="Output directory")
+    parser.add_argument("--scale", type=float, default=1.0, help="Size relative to the sample map, scales province count and image area")
+    parser.add_argument("--width", type=int, default=None, help="Image width, overrides --scale")
+    parser.add_argument("--height", type=int, default=None, help="Image height, overrides --scale")
+    parser.add_argument("--provinces", type=int, default=None, help="Land province count, overrides --scale")
+    parser.add_argument("--regions", type=int, default=None, help="Region count, default is one per ~6 provinces")
+    parser.add_argument("--levels", type=int, default=3, help="Number of province levels")
+    parser.add_argument("--seas", type=int, default=None, help="Number of inland seas")
+    parser.add_argument("--players", type=int, default=4, help="Number of players")
+    parser.add_argument("--owned", type=float, default=0.5, help="Fraction of provinces owned by players")
+    parser.add_argument("--border", type=int, default=1, help="Border width in pixels")
+    parser.add_argument("--seed", type=int, default=None, help="Random seed")
+    parser.add_argument("--loglevel", default="info", help="Logging level")
+    args = parser.parse_args()
+
+    logging.basicConfig(format="[%(asctime)s.%(msecs)03d][%(levelname)s][%(filename)s:%(lineno)s] %(message)s",
+                        datefmt="%Y-%m-%d %H:%M:%S", level=args.loglevel.upper())
+
+    axis: float = np.sqrt(args.scale)
+    provinces: int = args.provinces or int(BASE_PROVINCES * args.scale)
+    generator = Generator(width=args.width or int(BASE_WIDTH * axis),
+                          height=args.height or int(BASE_HEIGHT * axis),
+                          provinces=provinces,
+                          regions=args.regions or max(1, provinces // 6),
+                          levels=args.levels,
+                          seas=args.seas if args.seas != None else max(1, provinces // 60),
+                          border=args.border,
+                          seed=args.seed)
+    generator.generate()
+    generator.write(dest=args.out, players=args.players, owned=args.owned)
+
+
+if __name__ == "__main__":
+    main()
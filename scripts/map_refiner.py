@@ -1,215 +1,248 @@
-# This works but it is not pretty
-# It's also a little stupid
-# I'm so sorry
-
-
+#!/usr/bin/env python3
+'''Preprocessing pipeline that turns the original labelled map into map data.
+
+Stages, in order:
+    blackout  - paint the province greens black, leaving the lettering
+    letters   - paint the dark gray lettering pink
+    coords    - find the centroid of every label, drop near-duplicates
+    names     - name every centroid (interactive, cached in --names)
+    colors    - classify the level color under every named centroid
+    clean     - inpaint the lettering out of the base image
+
+Intermediate rasters and coordinates are cached in --cache, keyed on the
+inputs of each stage, so re-running after a map tweak only redoes the stages
+whose inputs changed.
+
+Run from the repository root, e.g.:
+    python3 -m scripts.map_refiner --original THC/map_original.png --image app/sample_data/image.png
+'''
+# External
+import argparse, hashlib, json, logging, time
 import cv2
 import numpy as np
-from tkinter import Tk, Label, Entry, Button
-from PIL import Image, ImageTk
-import json
-import os
-
-# Assuming dark, mid, and lite are defined as:
-dark = [0,76,0,255]
-mid = [0, 127, 0, 255]
-lite = [0, 178, 0, 255]
-
-def blackout():
-    """This takes the default map and turns it into black with gray lettering"""
-    # Load the image in color
-    image = cv2.imread('THC/map_original.png', cv2.IMREAD_COLOR)
-    # Define the color range for green
-    mid_green = np.array([0, 127, 0])  # use appropriate values
-    lower_green = np.array([0, 76, 0])  # use appropriate values
-    upper_green = np.array([0, 170, 0])  # use appropriate values
-    upper_green2 = np.array([11, 182, 11])  # use appropriate values
-    # Create a mask of green pixels
-    mask = cv2.inRange(image, mid_green, mid_green)
-    # Change all green (also near green) pixels to pink
-    image[mask == 255] = [0, 0, 0]  # Note that OpenCV uses BGR, not RGB
-    # Display the image
-    # Create a mask of green pixels
-    mask = cv2.inRange(image, upper_green, upper_green)
-    # Change all green (also near green) pixels to pink
-    image[mask == 255] = [0, 0, 0] # Note that OpenCV uses BGR, not RGB
-    # Display the image
-    # Create a mask of green pixels
-    mask = cv2.inRange(image, lower_green, lower_green)
-    # Change all green (also near green) pixels to pink
-    image[mask == 255] = [0, 0, 0]  # Note that OpenCV uses BGR, not RGB
-    # Create a mask of green pixels
-    mask = cv2.inRange(image, upper_green, upper_green2)
-    # Change all green (also near green) pixels to pink
-    image[mask == 255] = [0, 0, 0]  # Note that OpenCV uses BGR, not RGB
-    # Display the image
-    # Save the images
-    cv2.imwrite('Map_TMP_Blackout.jpg', image)
-    return image
-
-def pink_letters(image):
-    # Define the color range for green
-    dark_gray = np.array([20, 20, 20])  # use appropriate values
-    dark_gray2 = np.array([50, 50, 50])  # use appropriate values
-
-    # Create a mask of green pixels
-    mask = cv2.inRange(image, dark_gray, dark_gray2)
-
-    # Change all green (also near green) pixels to pink
-    image[mask == 255] = [180, 105, 255]  # Note that OpenCV uses BGR, not RGB
-    # image[mask == 255] = [0, 0, 0]  # Note that OpenCV uses BGR, not RGB
-
-    # Create a mask of green pixels
-    cv2.imwrite('Pink_Letters.jpg', image)
-
-    return image
-
-
-
-# Check the distance between two points
-def distance(pt1, pt2):
-    return int(((pt1[0] - pt2[0])**2 + (pt1[1] - pt2[1])**2)**0.5)
-
-
-def filter_coords(coords):
-    # Filter out the coordinates that are duplicates or super close
-    filtered_coords = []
-    dead = []
-    for pt in coords:
-        close = False
-        for fpt in filtered_coords:
-            # Check if the point is a duplicate or within the threshold
-            if pt == fpt or distance(pt, fpt) <= 22:
-                close = True
-                break
-        if not close:
-            filtered_coords.append(pt)
+from scipy.spatial import cKDTree
+from pathlib import Path
+
+
+# Level colors, BGR as read by OpenCV. Value is the level written to the map data.
+LEVELS: dict[str, tuple] = {"3": (0, 76, 0),   # dark
+                            "2": (0, 127, 0),  # mid
+                            "1": (0, 178, 0)}  # lite
+
+# Greens painted out by blackout: exact colors, plus one inclusive range
+GREENS: list[tuple] = [(0, 127, 0), (0, 170, 0), (0, 76, 0)]
+GREEN_RANGE: tuple = ((0, 170, 0), (11, 182, 11))
+
+LETTERS: tuple = ((20, 20, 20), (50, 50, 50)) # Dark gray lettering after blackout
+PINK: tuple = (180, 105, 255)
+PINK_HSV: tuple = ((150, 50, 50), (170, 255, 255))
+TEXT: tuple = (28, 28, 28) # Lettering color on the base image
+
+MIN_DISTANCE: int = 23 # Centroids closer than this are the same label
+WINDOW: int = 2        # Search radius around a centroid for a level color
+
+
+def pack(image: np.ndarray) -> np.ndarray:
+    '''Pack a 3-channel image into one uint32 per pixel
+    :image: (h, w, 3) uint8 array'''
+    return image[..., 0].astype(np.uint32) << 16 | image[..., 1].astype(np.uint32) << 8 | image[..., 2]
+
+
+def pack_color(color: tuple) -> int:
+    '''Pack a 3-channel color the same way as pack
+    :color: 3-element tuple'''
+    return color[0] << 16 | color[1] << 8 | color[2]
+
+
+class Cache:
+    '''Content-keyed cache of stage outputs'''
+    def __init__(self, path: Path, enabled: bool = True) -> None:
+        '''Content-keyed cache of stage outputs
+        :path: Cache directory
+        :enabled: Set False to always recompute'''
+        self.path: Path = path
+        self.enabled: bool = enabled
+        if (self.enabled):
+            self.path.mkdir(parents=True, exist_ok=True)
+
+    @staticmethod
+    def key(*parts) -> str:
+        '''Build a cache key from strings, bytes or arrays'''
+        h = hashlib.sha1()
+        for part in parts:
+            if (isinstance(part, np.ndarray)):
+                h.update(np.ascontiguousarray(part).data)
+            elif (isinstance(part, bytes)):
+                h.update(part)
+            else:
+                h.update(str(part).encode("utf-8"))
+        return h.hexdigest()[:16]
+
+    def get(self, stage: str, key: str):
+        '''Get a cached stage output, None if missing
+        :stage: Stage name
+        :key: Key of the stage inputs'''
+        if (not self.enabled):
+            return None
+        npy = self.path / f"{stage}-{key}.npy"
+        js = self.path / f"{stage}-{key}.json"
+        if (npy.exists()):
+            logging.info(f"Using cached {stage}: {npy.__str__()}")
+            return np.load(file=npy)
+        if (js.exists()):
+            logging.info(f"Using cached {stage}: {js.__str__()}")
+            with open(file=js.__str__(), mode="r", encoding="utf-8") as f:
+                return json.load(f)
+        return None
+
+    def put(self, stage: str, key: str, value) -> None:
+        '''Store a stage output
+        :stage: Stage name
+        :key: Key of the stage inputs
+        :value: np.ndarray or json-serializable object'''
+        if (not self.enabled):
+            return
+        if (isinstance(value, np.ndarray)):
+            np.save(file=self.path / f"{stage}-{key}.npy", arr=value)
         else:
-            dead.append(pt)
-    return filtered_coords
-
-
-def get_letter_coordinates(image):
-    """
-    Reads the blackout map and gets the location of all the words
-    This might need the pink map...
-    """
-    # Needs a black and white map
-    # img_path2 = 'THC/Map_TMP_Blackout.jpg'
-    # image = cv2.imread(img_path2)
-    # Convert image to HSV color space
+            with open(file=(self.path / f"{stage}-{key}.json").__str__(), mode="w", encoding="utf-8") as f:
+                json.dump(value, f)
+
+
+def blackout(image: np.ndarray) -> np.ndarray:
+    '''Paint the province greens black, leaving gray lettering. Returns a new image.
+    :image: BGR image'''
+    packed = pack(image=image)
+    mask = np.isin(packed, [pack_color(c) for c in GREENS])
+    mask |= cv2.inRange(image, np.array(GREEN_RANGE[0]), np.array(GREEN_RANGE[1])) == 255
+    out = image.copy()
+    out[mask] = (0, 0, 0)
+    return out
+
+
+def pink_letters(image: np.ndarray) -> np.ndarray:
+    '''Paint the dark gray lettering pink. Returns a new image.
+    :image: BGR image from blackout'''
+    mask = cv2.inRange(image, np.array(LETTERS[0]), np.array(LETTERS[1]))
+    out = image.copy()
+    out[mask == 255] = PINK
+    return out
+
+
+def filter_coords(coords: list, min_distance: float = MIN_DISTANCE) -> list:
+    '''Drop coordinates that are duplicates of, or closer than min_distance to, an earlier kept coordinate
+    :coords: List of (x, y)
+    :min_distance: Distance under which two points are the same'''
+    if (len(coords) == 0):
+        return []
+    points = np.asarray(coords, dtype=np.float64)
+    tree = cKDTree(points)
+    neighbors = tree.query_ball_point(points, r=min_distance - 1e-9)
+
+    # Greedy in input order, so the result matches a pairwise scan
+    kept = np.zeros(len(points), dtype=bool)
+    for i, near in enumerate(neighbors):
+        if (not any(kept[j] for j in near if j != i)):
+            kept[i] = True
+    return [tuple(coords[i]) for i in np.flatnonzero(kept)]
+
+
+def get_letter_coordinates(image: np.ndarray) -> list:
+    '''Get the centroid of every pink label, filtered for near-duplicates
+    :image: BGR image from pink_letters'''
     hsv = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
-        # Define range for pink color in HSV
-    lower_pink = np.array([150, 50, 50])  # These values may need adjustments
-    upper_pink = np.array([170, 255, 255])  # These values may need adjustments
-    # Threshold the HSV image to get only pink colors
-    mask = cv2.inRange(hsv, lower_pink, upper_pink)
-    # Morphological operations to remove noise and join parts of the letters
+    mask = cv2.inRange(hsv, np.array(PINK_HSV[0]), np.array(PINK_HSV[1]))
+
+    # Join the parts of each letter, then each label is one contour
     kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (2, 2))
     mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, kernel)
-    # Find contours
     contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-    centroids = []
-        # For each contour, find the centroid
+
+    centroids: list = []
     for contour in contours:
-        M = cv2.moments(contour)
-        if M["m00"] != 0:
-            cx = int(M["m10"] / M["m00"])
-            cy = int(M["m01"] / M["m00"])
+        m = cv2.moments(contour)
+        if (m["m00"] != 0):
+            centroids.append((int(m["m10"] / m["m00"]), int(m["m01"] / m["m00"])))
         else:
-            cx, cy = 0, 0
-        centroids.append((cx, cy))
-    log = []
-
-    for center in centroids:
-        # cv2.circle(image, center, 3, (0, 255, 0), -1)
-        log.append(center)
-
-    clean_coords = filter_coords(log)
-
-    with open('THC/territory_coords.json', 'w') as file:
-        data = json.dumps(clean_coords)
-        file.write(data)
-    return log
-
-
-
-def find_nearest_color(coord, image_data, width, height):
-    for y_offset in range(-2, 3):
-        for x_offset in range(-2, 3):
-            x, y = coord[0] + x_offset, coord[1] + y_offset
-            if x < 0 or y < 0 or x >= width or y >= height:
-                continue
-            tmplst = list(image_data[x, y])
-            print(tmplst)
-
-            if tmplst == dark:
-                return "3"
-            elif tmplst == mid:
-                return "2"
-            elif tmplst == lite:
-                return "1"
-            # Add conditions for 'lite' or any other colors here
-
-def get_territory_colors(all_coordinates):
-    img_path = 'sample_data/image.png'
-    image = Image.open(img_path)
-    width, height = image.size
-    image_data = image.load()
-    all_data = {}
-    for entry in all_coordinates:
-        coord = all_coordinates[entry]
-        all_data[entry] = {
-            'coordinates': coord
-        }
-        newColor = find_nearest_color(coord, image_data, width, height)
-        all_data[entry]['value'] = newColor
-
-    with open('map_data_master.json', 'w') as file:
-        data = json.dumps(all_data)
-        file.write(data)
-
-
-def remove_black_text(image_path, output_path):
-    # Read the image
-    img = cv2.imread(image_path, cv2.IMREAD_COLOR)
-
-    # Define the target color
-    target = [28, 28, 28]
+            centroids.append((0, 0))
+
+    return filter_coords(coords=centroids)
+
+
+def classify(image: np.ndarray) -> np.ndarray:
+    '''Get a level index raster, 0 where a pixel is not a level color
+    :image: BGR image'''
+    packed = pack(image=image)
+    codes = np.array([pack_color(c) for c in LEVELS.values()], dtype=np.uint32)
+    order = np.argsort(codes)
+    pos = np.clip(np.searchsorted(codes[order], packed), 0, len(codes) - 1)
+    hit = codes[order][pos] == packed
+    return np.where(hit, order[pos] + 1, 0).astype(np.uint8)
+
+
+def find_nearest_color(coords: list, levels: np.ndarray, window: int = WINDOW) -> list:
+    '''Get the level under each coordinate, the first level color in a (2*window+1)^2 box scanned row by row.
+    Returns level names, None where no level color is in the box.
+    :coords: List of (x, y)
+    :levels: Level index raster from classify
+    :window: Search radius'''
+    if (len(coords) == 0):
+        return []
+    height, width = levels.shape
+    points = np.asarray(coords, dtype=np.int64)
+    offsets = np.arange(-window, window + 1)
+    ys = points[:, 1, None, None] + offsets[None, :, None]
+    xs = points[:, 0, None, None] + offsets[None, None, :]
+    inside = (xs >= 0) & (ys >= 0) & (xs < width) & (ys < height)
+    boxes = np.where(inside, levels[np.clip(ys, 0, height - 1), np.clip(xs, 0, width - 1)], 0).reshape(len(points), -1)
+
+    first = np.argmax(boxes != 0, axis=1)
+    found = boxes[np.arange(len(points)), first]
+    names: list[str] = list(LEVELS)
+    return [names[f - 1] if f != 0 else None for f in found]
+
+
+def get_territory_colors(names_and_coords: dict, image: np.ndarray) -> dict:
+    '''Associate the level color with each named coordinate
+    :names_and_coords: dict of name -> (x, y)
+    :image: BGR base image'''
+    names: list[str] = list(names_and_coords)
+    values = find_nearest_color(coords=[names_and_coords[n] for n in names], levels=classify(image=image))
+    return {name: {"coordinates": names_and_coords[name], "value": value} for name, value in zip(names, values)}
+
+
+def remove_black_text(image: np.ndarray) -> np.ndarray:
+    '''Inpaint the lettering out of the base image. Returns a new image.
+    :image: BGR base image'''
+    mask = np.all(image == TEXT, axis=-1).astype(np.uint8) * 255
+    return cv2.inpaint(image, mask, inpaintRadius=3, flags=cv2.INPAINT_TELEA)
+
+
+def labeler(image_path: Path, points: list) -> dict:
+    '''Ask for the name of every point, showing a crop around it. Returns dict of name -> (x, y).
+    :image_path: Image to crop from
+    :points: List of (x, y)'''
+    # Only needed for this stage, and not available everywhere
+    from tkinter import Tk, Label, Entry, Button
+    from PIL import Image, ImageTk
 
-    # Create a binary mask where black pixels are set to 255 and all other pixels to 0
-    mask = np.all(img == target, axis=-1).astype(np.uint8) * 255
-
-    # Use the inpainting function
-    inpainted = cv2.inpaint(img, mask, inpaintRadius=3, flags=cv2.INPAINT_TELEA)
-
-    # Save the inpainted image
-    cv2.imwrite(output_path, inpainted)
-
-
-def show_point(image_path, points):
     root = Tk()
     image = Image.open(image_path)
     photo = ImageTk.PhotoImage(image)
     label = Label(root, image=photo)
     label.pack()
     entry = Entry(root)
-    def on_submit(event=None):  # The event parameter is optional, to handle both button and Enter key presses
-        root.quit()
     button = Button(root, text="Submit", command=root.quit)
-    def ask_name(point):
+
+    def ask_name(point) -> str:
         x, y = point
         crop_size = 50
-        left = x - crop_size
-        right = x + crop_size
-        top = y - crop_size
-        bottom = y + crop_size
-        cropped = image.crop((left, top, right, bottom))
+        cropped = image.crop((x - crop_size, y - crop_size, x + crop_size, y + crop_size))
         cropped_photo = ImageTk.PhotoImage(cropped)
         label.config(image=cropped_photo)
         entry.pack()
         button.pack()
-        entry.bind('<Return>', on_submit)
+        entry.bind('<Return>', lambda event=None: root.quit())
         root.mainloop()
         name = entry.get()
         entry.delete(0, 'end')
@@ -217,49 +250,115 @@ def show_point(image_path, points):
         entry.pack_forget()
         button.pack_forget()
         return name
-    names = {}
+
+    names: dict = {}
     for point in points:
-        name = ask_name(point)
-        names[name] = point
-        print(names)
+        names[ask_name(point)] = point
+        logging.debug(f"Named points: {names}")
     root.destroy()
     return names
 
 
-def labeler(filtered_coords):
-    image_path = "sample_data/image.png"
-    result = show_point(image_path, filtered_coords)
-
-    # Write the names of the countries and their coordinates to a file
-    with open('territory_names.json', 'w') as file:
-        data = json.dumps(result)
-        file.write(data)
-        file.close()
-
-    return result
-
-
-
-# Make everything the same color, not sure if this is necessery
-img = blackout()
-
-# Make the letters pink for some reason, ditto on necesseryness, I was hammered I'm sorry
-img = pink_letters(img)
-
-# Get all the coordinates where Python can see pink text, AKA get the center of each territory
-all_coordinates = get_letter_coordinates(img)
-
-# Extremely tedious manual process of typing the names in for each province, but this makes it a little less painful
-if os.path.exists('THC/names.json'):
-    with open('THC/names.json','r') as file:
-        data = file.read()
-        names_and_coords = json.loads(data)
-else:
-    names_and_coords = labeler(all_coordinates)
-
-print(names_and_coords)
-# Grabs the color of each territory and associates it with the coordinates
-get_territory_colors(names_and_coords)
-
-# Removes the labels from the map so that the territories are completely green
-remove_black_text('sample_data/image.png', 'image_no_names.png')
+class Pipeline:
+    '''Runs the refiner stages with caching'''
+    def __init__(self, original: Path, image: Path, names: Path, out: Path, cache: Cache, debug: bool = False) -> None:
+        '''Runs the refiner stages with caching
+        :original: Original labelled map
+        :image: Base map image, source for colors and cleaning
+        :names: Name -> coordinate file, written by the names stage
+        :out: Output directory
+        :cache: Cache of stage outputs
+        :debug: Also write intermediate images to the output directory'''
+        self.original: Path = original
+        self.image: Path = image
+        self.names: Path = names
+        self.out: Path = out
+        self.cache: Cache = cache
+        self.debug: bool = debug
+
+    def __stage(self, stage: str, key: str, func):
+        '''Run a stage, or get its output from the cache'''
+        tic = time.perf_counter()
+        value = self.cache.get(stage=stage, key=key)
+        if (value is None):
+            logging.info(f"Running stage: {stage}")
+            value = func()
+            self.cache.put(stage=stage, key=key, value=value)
+        toc = time.perf_counter()
+        logging.info(f"Stage {stage} completed! {toc - tic:0.4f}s")
+        return value
+
+    def __write_image(self, name: str, image: np.ndarray) -> None:
+        path = self.out / name
+        logging.info(f"Writing image to {path.__str__()}")
+        cv2.imwrite(path.__str__(), image)
+
+    def __write_json(self, name: str, data) -> None:
+        path = self.out / name
+        logging.info(f"Writing data to file: {path.__str__()}")
+        with open(file=path.__str__(), mode="w", encoding="utf-8") as f:
+            json.dump(data, f, indent=2)
+
+    def run(self, stages: list[str]) -> None:
+        '''Run the requested stages, and whatever earlier stages they need
+        :stages: Stage names, any of blackout, letters, coords, names, colors, clean'''
+        self.out.mkdir(parents=True, exist_ok=True)
+
+        if (any(s in stages for s in ["blackout", "letters", "coords", "names"])):
+            original = cv2.imread(self.original.__str__(), cv2.IMREAD_COLOR)
+            key = Cache.key("blackout", original)
+            dark = self.__stage("blackout", key, lambda: blackout(image=original))
+            key = Cache.key("letters", key)
+            pink = self.__stage("letters", key, lambda: pink_letters(image=dark))
+            key = Cache.key("coords", key, MIN_DISTANCE)
+            coords = [tuple(c) for c in self.__stage("coords", key, lambda: get_letter_coordinates(image=pink))]
+            self.__write_json("territory_coords.json", coords)
+            if (self.debug):
+                self.__write_image("Map_TMP_Blackout.png", dark)
+                self.__write_image("Pink_Letters.png", pink)
+
+            if ("names" in stages and not self.names.exists()):
+                names = labeler(image_path=self.image, points=coords)
+                with open(file=self.names.__str__(), mode="w", encoding="utf-8") as f:
+                    json.dump(names, f)
+
+        base = cv2.imread(self.image.__str__(), cv2.IMREAD_COLOR)
+
+        if ("colors" in stages):
+            with open(file=self.names.__str__(), mode="r", encoding="utf-8") as f:
+                names_and_coords = json.load(f)
+            key = Cache.key("colors", base, json.dumps(names_and_coords, sort_keys=True), WINDOW)
+            self.__write_json("map_data_master.json",
+                              self.__stage("colors", key, lambda: get_territory_colors(names_and_coords=names_and_coords, image=base)))
+
+        if ("clean" in stages):
+            key = Cache.key("clean", base)
+            self.__write_image("image_no_names.png", self.__stage("clean", key, lambda: remove_black_text(image=base)))
+
+
+STAGES: list[str] = ["blackout", "letters", "coords", "names", "colors", "clean"]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Refine the original map into map data and a clean base image.")
+    parser.add_argument("--original", type=Path, default=Path("THC/map_original.png"), help="Original labelled map")
+    parser.add_argument("--image", type=Path, default=Path("app/sample_data/image.png"), help="Base map image")
+    parser.add_argument("--names", type=Path, default=Path("THC/names.json"), help="Name -> coordinate file")
+    parser.add_argument("--out", type=Path, default=Path("scripts"), help="Output directory")
+    parser.add_argument("--cache", type=Path, default=Path(".refiner_cache"), help="Cache directory for stage outputs")
+    parser.add_argument("--no-cache", action="store_true", help="Recompute every stage")
+    parser.add_argument("--stages", nargs="+", choices=STAGES, default=STAGES, help="Stages to run")
+    parser.add_argument("--debug", action="store_true", help="Also write intermediate images")
+    parser.add_argument("--loglevel", default="info", help="Logging level")
+    args = parser.parse_args()
+
+    logging.basicConfig(format="[%(asctime)s.%(msecs)03d][%(levelname)s][%(filename)s:%(lineno)s] %(message)s",
+                        datefmt="%Y-%m-%d %H:%M:%S", level=args.loglevel.upper())
+
+    pipeline = Pipeline(original=args.original, image=args.image, names=args.names, out=args.out,
+                        cache=Cache(path=args.cache, enabled=not args.no_cache), debug=args.debug)
+    pipeline.run(stages=args.stages)
+
+
+if __name__ == "__main__":
+    main()